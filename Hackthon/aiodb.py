@@ -0,0 +1,107 @@
+"""Minimal async database access for the ASGI routes in asgi.py.
+
+The synchronous app goes through Flask-SQLAlchemy; the handful of read
+queries served on the event loop talk to the driver directly: aiosqlite for
+SQLite and psycopg's AsyncConnection for PostgreSQL (both optional, see
+requirements-async.txt). Connections are pooled per process.
+
+SQL uses :name placeholders, translated to the driver's style.
+"""
+import asyncio
+import re
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+from sqlalchemy.engine import make_url
+
+try:
+    import aiosqlite
+except ImportError:  # optional
+    aiosqlite = None
+
+try:
+    import psycopg
+except ImportError:  # optional
+    psycopg = None
+
+_NAMED_RE = re.compile(r'(?<!:):(\w+)')
+
+
+def as_datetime(value):
+    """SQLite hands DateTime columns back as text; PostgreSQL as datetime."""
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
+
+
+class AsyncDatabase(object):
+    def __init__(self, url, pool_size=10):
+        self.url = make_url(url)
+        self.backend = self.url.get_backend_name()
+        self.pool_size = pool_size
+        self._idle = []
+        self._available = None
+        if self.backend == 'sqlite':
+            if aiosqlite is None:
+                raise RuntimeError('aiosqlite is required for async SQLite access')
+        elif self.backend == 'postgresql':
+            if psycopg is None:
+                raise RuntimeError('psycopg is required for async PostgreSQL access')
+        else:
+            raise RuntimeError('no async driver for %r databases' % self.backend)
+
+    async def _connect(self):
+        if self.backend == 'sqlite':
+            conn = await aiosqlite.connect(self.url.database or ':memory:')
+            await conn.execute('PRAGMA query_only = ON')
+            return conn
+        conninfo = self.url.set(drivername='postgresql').render_as_string(hide_password=False)
+        return await psycopg.AsyncConnection.connect(conninfo, autocommit=True)
+
+    @asynccontextmanager
+    async def connection(self):
+        if self._available is None:
+            self._available = asyncio.Semaphore(self.pool_size)
+        async with self._available:
+            conn = self._idle.pop() if self._idle else await self._connect()
+            try:
+                yield conn
+            except BaseException:
+                await conn.close()
+                raise
+            self._idle.append(conn)
+
+    def _sql(self, sql):
+        if self.backend == 'postgresql':
+            return _NAMED_RE.sub(r'%(\1)s', sql)
+        return sql
+
+    async def iterate(self, sql, params=None, batch=200):
+        """Yield rows as dicts, fetching `batch` at a time."""
+        async with self.connection() as conn:
+            if self.backend == 'sqlite':
+                cursor = await conn.execute(self._sql(sql), params or {})
+            else:
+                cursor = conn.cursor()
+                await cursor.execute(self._sql(sql), params or {})
+            try:
+                names = [col[0] for col in cursor.description]
+                while True:
+                    rows = await cursor.fetchmany(batch)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield dict(zip(names, row))
+            finally:
+                await cursor.close()
+
+    async def fetch(self, sql, params=None):
+        return [row async for row in self.iterate(sql, params)]
+
+    async def scalar(self, sql, params=None):
+        rows = await self.fetch(sql, params)
+        return next(iter(rows[0].values())) if rows else None
+
+    async def close(self):
+        while self._idle:
+            await self._idle.pop().close()
@@ -1,21 +1,83 @@
-from flask import Flask, request, jsonify, session, send_from_directory
+from flask import Blueprint, Flask, current_app, request, session, send_from_directory, stream_with_context
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 import os
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
+import click
+from flask.cli import AppGroup, with_appcontext
 from dotenv import load_dotenv
-
-load_dotenv()
-app = Flask(__name__, static_folder='.', static_url_path='')
-app.config['SECRET_KEY'] = 'your-secret-key'
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///lms.db')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(__file__), 'uploads')
-CORS(app)
-
-db = SQLAlchemy(app)
+from ratelimit import RateLimiter
+from instrumentation import Instrumentation
+from jsonprovider import JSONProvider, dumps, jsonify, stream_json_array
+from compression import Compression
+import retention
+import batch
+from roster import RosterCache
+
+db = SQLAlchemy()
+bp = Blueprint('lms', __name__)
+
+def default_config():
+    return {
+        'SECRET_KEY': os.getenv('SECRET_KEY', 'your-secret-key'),
+        'SQLALCHEMY_DATABASE_URI': os.getenv('DATABASE_URL', 'sqlite:///lms.db'),
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        'UPLOAD_FOLDER': os.path.join(os.path.dirname(__file__), 'uploads'),
+        # Lets a Prometheus scraper on another host read /metrics (see instrumentation.py)
+        'INSTRUMENT_METRICS_TOKEN': os.getenv('METRICS_TOKEN'),
+        # Shared rate-limit buckets for several workers (see ratelimit.py)
+        'RATELIMIT_REDIS_URL': os.getenv('RATELIMIT_REDIS_URL'),
+        # Notification retention (see retention.py); interval 0 = purge via CLI/cron only
+        'NOTIFICATION_READ_TTL_DAYS': int(os.getenv('NOTIFICATION_READ_TTL_DAYS', '30')),
+        'NOTIFICATION_UNREAD_TTL_DAYS': int(os.getenv('NOTIFICATION_UNREAD_TTL_DAYS', '180')),
+        'NOTIFICATION_ARCHIVE': True,
+        'NOTIFICATION_ARCHIVE_TTL_DAYS': None,
+        'NOTIFICATION_PURGE_BATCH': 500,
+        'NOTIFICATION_PURGE_INTERVAL': int(os.getenv('NOTIFICATION_PURGE_INTERVAL', '0')),
+        # Live notification stream (server-sent events); under WSGI each open
+        # stream holds a worker thread for up to the timeout, see asgi.py
+        'NOTIFICATION_STREAM_INTERVAL': 2,
+        'NOTIFICATION_STREAM_HEARTBEAT': 15,
+        'NOTIFICATION_STREAM_TIMEOUT': 300,
+        # /api/batch (see batch.py)
+        'BATCH_MAX_REQUESTS': 20,
+        'BATCH_MAX_WORKERS': 4,
+    }
+
+def create_app(config=None):
+    """Build the application. Nothing here touches the database, so workers start fast;
+    schema and seed data are handled by the `flask db init` and `flask seed` commands."""
+    started = time.perf_counter()
+    load_dotenv()
+    app = Flask(__name__, static_folder='.', static_url_path='')
+    app.config.update(default_config())
+    if isinstance(config, dict):
+        app.config.update(config)
+    elif config is not None:
+        app.config.from_object(config)
+    CORS(app)
+    JSONProvider(app)
+    db.init_app(app)
+    RateLimiter(app)
+    instrumentation = Instrumentation(app)
+    Compression(app)
+    RosterCache(app, loader=load_roster, model=Enrollment)
+    app.register_blueprint(bp)
+    app.cli.add_command(db_cli)
+    app.cli.add_command(seed_command)
+    app.cli.add_command(notifications_cli)
+    if app.config['NOTIFICATION_PURGE_INTERVAL']:
+        worker = retention.PurgeWorker(app, purge_notifications, app.config['NOTIFICATION_PURGE_INTERVAL'])
+        app.extensions['notification_purge'] = worker
+        worker.start()
+    app.config['STARTUP_SECONDS'] = time.perf_counter() - started
+    instrumentation.registry.gauge(
+        'lms_app_startup_seconds', 'Time spent in create_app for this worker.',
+        (), lambda: {(): app.config['STARTUP_SECONDS']})
+    return app
 
 # Models
 class User(db.Model):
@@ -109,6 +171,35 @@ class Notification(db.Model):
     
     user = db.relationship('User')
 
+    __table_args__ = (
+        db.Index('ix_notification_user_created', 'user_id', 'created_at'),
+        db.Index('ix_notification_created', 'created_at'),
+        # Never reuse ids of purged rows: stream cursors and the archive rely on them
+        {'sqlite_autoincrement': True},
+    )
+
+class NotificationArchive(db.Model):
+    __tablename__ = 'notification_archive'
+    # No FK so users can be removed later
+    id = db.Column(db.Integer, primary_key=True)
+    original_id = db.Column(db.Integer, nullable=False, unique=True, index=True)
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+    title = db.Column(db.String(120), nullable=False)
+    message = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, index=True)
+    read = db.Column(db.Boolean, default=False)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+def load_roster(course_id):
+    return [sid for (sid,) in db.session.query(Enrollment.student_id).filter_by(course_id=course_id)]
+
+def course_roster(course_id):
+    """Frozenset of student ids enrolled in the course (cached, see roster.py)."""
+    return current_app.extensions['roster'].get(course_id)
+
+def is_enrolled(student_id, course_id):
+    return current_app.extensions['roster'].contains(course_id, student_id)
+
 def notify(user_ids, title, message):
     if not isinstance(user_ids, (list, tuple, set)):
         user_ids = [user_ids]
@@ -117,7 +208,7 @@ def notify(user_ids, title, message):
     db.session.commit()
 
 # Routes
-@app.route('/api/register', methods=['POST'])
+@bp.route('/api/register', methods=['POST'])
 def register():
     data = request.json
     
@@ -140,7 +231,7 @@ def register():
     
     return jsonify({'message': 'User registered successfully'}), 201
 
-@app.route('/api/login', methods=['POST'])
+@bp.route('/api/login', methods=['POST'])
 def login():
     data = request.json
     
@@ -161,7 +252,7 @@ def login():
         }
     }), 200
 
-@app.route('/api/courses', methods=['GET'])
+@bp.route('/api/courses', methods=['GET'])
 def get_courses():
     courses = Course.query.all()
     course_list = []
@@ -176,7 +267,7 @@ def get_courses():
         })
     return jsonify(course_list), 200
 
-@app.route('/api/courses', methods=['POST'])
+@bp.route('/api/courses', methods=['POST'])
 def create_course():
     data = request.json
     # Validate teacher
@@ -193,7 +284,7 @@ def create_course():
     db.session.commit()
     return jsonify({'message': 'Course created successfully', 'course_id': new_course.id}), 201
 
-@app.route('/api/enroll', methods=['POST'])
+@bp.route('/api/enroll', methods=['POST'])
 def enroll_course():
     data = request.json
     # Validate student
@@ -204,19 +295,15 @@ def enroll_course():
     course = Course.query.get(data['course_id'])
     if not course:
         return jsonify({'error': 'Course not found'}), 404
-    # Check if already enrolled
-    existing_enrollment = Enrollment.query.filter_by(
-        student_id=student.id,
-        course_id=course.id
-    ).first()
-    if existing_enrollment:
+    # Check if already enrolled; ask the database, a cached roster may miss another worker's insert
+    if db.session.query(Enrollment.id).filter_by(student_id=student.id, course_id=course.id).first():
         return jsonify({'error': 'Already enrolled in this course'}), 400
     new_enrollment = Enrollment(student_id=student.id, course_id=course.id)
     db.session.add(new_enrollment)
     db.session.commit()
     return jsonify({'message': 'Enrolled successfully'}), 201
 
-@app.route('/api/my-courses/<int:student_id>', methods=['GET'])
+@bp.route('/api/my-courses/<int:student_id>', methods=['GET'])
 def get_enrolled_courses(student_id):
     enrollments = Enrollment.query.filter_by(student_id=student_id).all()
     courses = []
@@ -233,7 +320,7 @@ def get_enrolled_courses(student_id):
     
     return jsonify(courses), 200
 
-@app.route('/api/course-students/<int:course_id>', methods=['GET'])
+@bp.route('/api/course-students/<int:course_id>', methods=['GET'])
 def get_course_students(course_id):
     enrollments = Enrollment.query.filter_by(course_id=course_id).all()
     students = []
@@ -248,7 +335,7 @@ def get_course_students(course_id):
     
     return jsonify(students), 200
 
-@app.route('/api/teacher-courses/<int:teacher_id>', methods=['GET'])
+@bp.route('/api/teacher-courses/<int:teacher_id>', methods=['GET'])
 def get_teacher_courses(teacher_id):
     # Validate teacher
     teacher = User.query.get(teacher_id)
@@ -265,7 +352,7 @@ def get_teacher_courses(teacher_id):
         })
     return jsonify(course_list), 200
 
-@app.route('/api/course/<int:course_id>', methods=['GET'])
+@bp.route('/api/course/<int:course_id>', methods=['GET'])
 def get_course_detail(course_id):
     course = Course.query.get(course_id)
     if not course:
@@ -280,7 +367,7 @@ def get_course_detail(course_id):
     }), 200
 
 # Course Completion
-@app.route('/api/course/complete', methods=['POST'])
+@bp.route('/api/course/complete', methods=['POST'])
 def complete_course():
     data = request.json or {}
     student_id = data.get('student_id', None)
@@ -296,8 +383,7 @@ def complete_course():
     if not course:
         return jsonify({'error': 'Course not found'}), 404
 
-    enrollment = Enrollment.query.filter_by(student_id=student.id, course_id=course.id).first()
-    if not enrollment:
+    if not is_enrolled(student.id, course.id):
         return jsonify({'error': 'Student is not enrolled in this course'}), 403
 
     # Ensure a 'Course Completion' assignment exists for this course
@@ -328,7 +414,7 @@ def complete_course():
 
     return jsonify({'message': 'Course marked as completed', 'submission_id': submission.id}), 201
 
-@app.route('/api/course/<int:course_id>/completion', methods=['GET'])
+@bp.route('/api/course/<int:course_id>/completion', methods=['GET'])
 def get_course_completion(course_id):
     student_id = request.args.get('student_id', type=int)
     course = Course.query.get(course_id)
@@ -346,7 +432,7 @@ def get_course_completion(course_id):
     return jsonify({'completed': existing is not None}), 200
 
 # Assignment & Submission APIs
-@app.route('/api/assignments', methods=['POST'])
+@bp.route('/api/assignments', methods=['POST'])
 def create_assignment():
     data = request.json
     title = data.get('title')
@@ -383,14 +469,13 @@ def create_assignment():
     db.session.add(assignment)
     db.session.commit()
     # Notify enrolled students
-    enrolled = Enrollment.query.filter_by(course_id=course_id).all()
-    student_ids = [e.student_id for e in enrolled]
+    student_ids = list(course_roster(course.id))
     if student_ids:
         notify(student_ids, 'New Assignment', f"{title} has been posted in {assignment.course.title}")
 
     return jsonify({'message': 'Assignment created', 'assignment_id': assignment.id}), 201
 
-@app.route('/api/course/<int:course_id>/assignments', methods=['GET'])
+@bp.route('/api/course/<int:course_id>/assignments', methods=['GET'])
 def get_course_assignments(course_id):
     course = Course.query.get(course_id)
     if not course:
@@ -403,26 +488,26 @@ def get_course_assignments(course_id):
             'id': a.id,
             'title': a.title,
             'description': a.description,
-            'due_date': a.due_date.isoformat(),
+            'due_date': a.due_date,
             'course_id': a.course_id
         })
     return jsonify(result), 200
 
 # Discussion APIs
-@app.route('/api/course/<int:course_id>/discussion', methods=['GET'])
+@bp.route('/api/course/<int:course_id>/discussion', methods=['GET'])
 def get_discussion(course_id):
-    posts = DiscussionPost.query.filter_by(course_id=course_id).order_by(DiscussionPost.created_at.asc()).all()
-    return jsonify([
+    posts = DiscussionPost.query.filter_by(course_id=course_id).order_by(DiscussionPost.created_at.asc())
+    return stream_json_array(
         {
             'id': p.id,
             'user_id': p.user_id,
             'user_name': p.user.name,
             'content': p.content,
-            'created_at': p.created_at.isoformat()
+            'created_at': p.created_at
         } for p in posts
-    ]), 200
+    )
 
-@app.route('/api/course/<int:course_id>/discussion', methods=['POST'])
+@bp.route('/api/course/<int:course_id>/discussion', methods=['POST'])
 def post_discussion(course_id):
     data = request.json or {}
     user_id = data.get('user_id')
@@ -439,8 +524,7 @@ def post_discussion(course_id):
     db.session.add(post)
     db.session.commit()
     # Notify course members (enrolled students and teacher) except poster
-    enrolled = Enrollment.query.filter_by(course_id=course_id).all()
-    recipient_ids = {e.student_id for e in enrolled}
+    recipient_ids = set(course_roster(course.id))
     recipient_ids.add(course.teacher_id)
     if user_id in recipient_ids:
         recipient_ids.remove(user_id)
@@ -449,7 +533,7 @@ def post_discussion(course_id):
     return jsonify({'message': 'Posted', 'id': post.id}), 201
 
 # Materials APIs
-@app.route('/api/course/<int:course_id>/materials', methods=['GET'])
+@bp.route('/api/course/<int:course_id>/materials', methods=['GET'])
 def list_materials(course_id):
     mats = Material.query.filter_by(course_id=course_id).order_by(Material.uploaded_at.desc()).all()
     return jsonify([
@@ -457,13 +541,13 @@ def list_materials(course_id):
             'id': m.id,
             'filename': m.filename,
             'url': m.url,
-            'uploaded_at': m.uploaded_at.isoformat(),
+            'uploaded_at': m.uploaded_at,
             'uploader_id': m.uploader_id,
             'uploader_name': m.uploader.name
         } for m in mats
     ]), 200
 
-@app.route('/api/course/<int:course_id>/materials', methods=['POST'])
+@bp.route('/api/course/<int:course_id>/materials', methods=['POST'])
 def upload_material(course_id):
     uploader_id = request.form.get('uploader_id', type=int)
     file = request.files.get('file')
@@ -479,39 +563,74 @@ def upload_material(course_id):
     if user.role != 'teacher' or user.id != course.teacher_id:
         return jsonify({'error': 'Only course teacher can upload materials'}), 403
     # Save file
-    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-    subdir = os.path.join(app.config['UPLOAD_FOLDER'], f"materials", f"course_{course.id}")
+    os.makedirs(current_app.config['UPLOAD_FOLDER'], exist_ok=True)
+    subdir = os.path.join(current_app.config['UPLOAD_FOLDER'], f"materials", f"course_{course.id}")
     os.makedirs(subdir, exist_ok=True)
     filename = secure_filename(file.filename or 'material')
     path = os.path.join(subdir, filename)
     file.save(path)
-    rel = os.path.relpath(path, os.path.dirname(__file__))
-    public_url = f"/{rel.replace('\\', '/')}"
+    rel = os.path.relpath(path, os.path.dirname(__file__)).replace(os.sep, '/')
+    public_url = f"/{rel}"
     m = Material(course_id=course.id, uploader_id=user.id, filename=filename, url=public_url)
     db.session.add(m)
     db.session.commit()
     # Notify enrolled students
-    enrolled = Enrollment.query.filter_by(course_id=course.id).all()
-    student_ids = [e.student_id for e in enrolled]
+    student_ids = list(course_roster(course.id))
     if student_ids:
         notify(student_ids, 'New Material', f"New material uploaded in {course.title}: {filename}")
     return jsonify({'message': 'Uploaded', 'id': m.id, 'url': public_url}), 201
 
 # Notifications APIs
-@app.route('/api/notifications/<int:user_id>', methods=['GET'])
+@bp.route('/api/notifications/<int:user_id>', methods=['GET'])
 def get_notifications(user_id):
-    notifs = Notification.query.filter_by(user_id=user_id).order_by(Notification.created_at.desc()).all()
-    return jsonify([
+    notifs = Notification.query.filter_by(user_id=user_id).order_by(Notification.created_at.desc())
+    return stream_json_array(
         {
             'id': n.id,
             'title': n.title,
             'message': n.message,
-            'created_at': n.created_at.isoformat(),
+            'created_at': n.created_at,
             'read': n.read
         } for n in notifs
-    ]), 200
+    )
 
-@app.route('/api/notifications/mark-read', methods=['POST'])
+def sse_event(event_id, data, event='notification'):
+    """One server-sent event; `data` is JSON text."""
+    return f"id: {event_id}\nevent: {event}\ndata: {data}\n\n"
+
+@bp.route('/api/notifications/<int:user_id>/stream', methods=['GET'])
+def stream_notifications(user_id):
+    # Resume after Last-Event-ID on reconnect, otherwise send only new notifications
+    last_id = request.headers.get('Last-Event-ID', type=int) or request.args.get('after', type=int)
+    if last_id is None:
+        last_id = db.session.query(db.func.max(Notification.id)).filter(Notification.user_id == user_id).scalar() or 0
+    config = current_app.config
+    interval, heartbeat = config['NOTIFICATION_STREAM_INTERVAL'], config['NOTIFICATION_STREAM_HEARTBEAT']
+
+    def generate():
+        cursor = last_id
+        yield f"retry: {int(interval * 1000)}\n\n"
+        started = quiet = time.monotonic()
+        while time.monotonic() - started < config['NOTIFICATION_STREAM_TIMEOUT']:
+            notifs = Notification.query.filter(Notification.user_id == user_id, Notification.id > cursor) \
+                .order_by(Notification.id).limit(100).all()
+            # End the read transaction so the next poll sees new rows
+            db.session.rollback()
+            for n in notifs:
+                cursor = n.id
+                yield sse_event(n.id, dumps({'id': n.id, 'title': n.title, 'message': n.message,
+                                             'created_at': n.created_at, 'read': n.read}))
+            if notifs:
+                quiet = time.monotonic()
+            elif time.monotonic() - quiet >= heartbeat:
+                quiet = time.monotonic()
+                yield ': keepalive\n\n'
+            time.sleep(interval)
+
+    return current_app.response_class(stream_with_context(generate()), mimetype='text/event-stream',
+                                      headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@bp.route('/api/notifications/mark-read', methods=['POST'])
 def mark_notifications_read():
     data = request.json or {}
     ids = data.get('ids', [])
@@ -522,14 +641,14 @@ def mark_notifications_read():
     return jsonify({'message': 'Marked read'}), 200
 
 # Public config for frontend (safe: anon key only)
-@app.route('/api/public-config', methods=['GET'])
+@bp.route('/api/public-config', methods=['GET'])
 def public_config():
     return jsonify({
         'supabaseUrl': os.getenv('SUPABASE_URL', ''),
         'supabaseKey': os.getenv('SUPABASE_ANON_KEY', '')
     }), 200
 
-@app.route('/api/user/<int:user_id>', methods=['PUT'])
+@bp.route('/api/user/<int:user_id>', methods=['PUT'])
 def update_user(user_id):
     data = request.json or {}
     user = User.query.get(user_id)
@@ -552,7 +671,7 @@ def update_user(user_id):
     db.session.commit()
     return jsonify({'id': user.id, 'name': user.name, 'email': user.email, 'role': user.role}), 200
 
-@app.route('/api/grades/student/<int:student_id>', methods=['GET'])
+@bp.route('/api/grades/student/<int:student_id>', methods=['GET'])
 def get_student_grades(student_id):
     student = User.query.get(student_id)
     if not student or student.role != 'student':
@@ -582,7 +701,7 @@ def get_student_grades(student_id):
             'submission_id': s.id,
             'assignment_id': s.assignment_id,
             'assignment_title': s.assignment.title,
-            'submitted_at': s.submitted_at.isoformat(),
+            'submitted_at': s.submitted_at,
             'grade': s.grade,
             'feedback': s.feedback,
             'content': s.content
@@ -602,7 +721,7 @@ def get_student_grades(student_id):
 
     return jsonify(result), 200
 
-@app.route('/api/submission/<int:submission_id>/grade', methods=['POST'])
+@bp.route('/api/submission/<int:submission_id>/grade', methods=['POST'])
 def grade_submission(submission_id):
     data = request.json or {}
     teacher_id = data.get('teacher_id')
@@ -638,7 +757,7 @@ def grade_submission(submission_id):
     return jsonify({'message': 'Submission graded', 'submission_id': sub.id, 'grade': sub.grade, 'feedback': sub.feedback}), 200
 
 # Attendance APIs
-@app.route('/api/attendance/mark', methods=['POST'])
+@bp.route('/api/attendance/mark', methods=['POST'])
 def mark_attendance():
     data = request.json
     teacher_id = data.get('teacher_id')
@@ -664,13 +783,12 @@ def mark_attendance():
     except Exception:
         return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD'}), 400
 
-    # Only students enrolled can be marked
-    enrolled_ids = {en.student_id for en in Enrollment.query.filter_by(course_id=course.id).all()}
+    # Only students enrolled can be marked; is_enrolled reloads a stale roster on a miss
     upserted = 0
     for r in records:
         sid = r.get('student_id')
         present = bool(r.get('present'))
-        if sid not in enrolled_ids:
+        if not is_enrolled(sid, course.id):
             continue
         rec = Attendance.query.filter_by(student_id=sid, course_id=course.id, date=target_date).first()
         if rec:
@@ -683,7 +801,7 @@ def mark_attendance():
 
     return jsonify({'message': 'Attendance saved', 'updated': upserted, 'date': target_date.isoformat()}), 200
 
-@app.route('/api/attendance/course/<int:course_id>', methods=['GET'])
+@bp.route('/api/attendance/course/<int:course_id>', methods=['GET'])
 def get_course_attendance(course_id):
     date_str = request.args.get('date')  # YYYY-MM-DD
     teacher_id = request.args.get('teacher_id', type=int)
@@ -703,7 +821,7 @@ def get_course_attendance(course_id):
     result = [{'student_id': r.student_id, 'student_name': r.student.name, 'present': r.present} for r in records]
     return jsonify({'course_id': course.id, 'date': target_date.isoformat(), 'records': result}), 200
 
-@app.route('/api/attendance/student/<int:student_id>', methods=['GET'])
+@bp.route('/api/attendance/student/<int:student_id>', methods=['GET'])
 def get_student_attendance_summary(student_id):
     student = User.query.get(student_id)
     if not student or student.role != 'student':
@@ -724,7 +842,7 @@ def get_student_attendance_summary(student_id):
         })
     return jsonify(summaries), 200
 
-@app.route('/api/student/<int:student_id>/assignments', methods=['GET'])
+@bp.route('/api/student/<int:student_id>/assignments', methods=['GET'])
 def get_student_assignments(student_id):
     student = User.query.get(student_id)
     if not student or student.role != 'student':
@@ -744,14 +862,14 @@ def get_student_assignments(student_id):
             'id': a.id,
             'title': a.title,
             'description': a.description,
-            'due_date': a.due_date.isoformat(),
+            'due_date': a.due_date,
             'course_id': a.course_id,
             'submitted': existing_submission is not None,
             'submission_id': existing_submission.id if existing_submission else None
         })
     return jsonify(result), 200
 
-@app.route('/api/submit', methods=['POST'])
+@bp.route('/api/submit', methods=['POST'])
 def submit_assignment():
     data = request.json
     student_id = data.get('student_id')
@@ -770,8 +888,7 @@ def submit_assignment():
         return jsonify({'error': 'Assignment not found'}), 404
 
     # Ensure student is enrolled in the assignment's course
-    enrollment = Enrollment.query.filter_by(student_id=student.id, course_id=assignment.course_id).first()
-    if not enrollment:
+    if not is_enrolled(student.id, assignment.course_id):
         return jsonify({'error': 'Student is not enrolled in this course'}), 403
 
     # Prevent duplicate submission
@@ -785,7 +902,7 @@ def submit_assignment():
 
     return jsonify({'message': 'Submission successful', 'submission_id': submission.id}), 201
 
-@app.route('/api/submit-file', methods=['POST'])
+@bp.route('/api/submit-file', methods=['POST'])
 def submit_assignment_file():
     student_id = request.form.get('student_id', type=int)
     assignment_id = request.form.get('assignment_id', type=int)
@@ -802,8 +919,7 @@ def submit_assignment_file():
     if not assignment:
         return jsonify({'error': 'Assignment not found'}), 404
 
-    enrollment = Enrollment.query.filter_by(student_id=student.id, course_id=assignment.course_id).first()
-    if not enrollment:
+    if not is_enrolled(student.id, assignment.course_id):
         return jsonify({'error': 'Student is not enrolled in this course'}), 403
 
     existing = Submission.query.filter_by(student_id=student.id, assignment_id=assignment.id).first()
@@ -811,16 +927,16 @@ def submit_assignment_file():
         return jsonify({'error': 'Assignment already submitted'}), 400
 
     # Save file
-    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-    subdir = os.path.join(app.config['UPLOAD_FOLDER'], f"assignment_{assignment.id}", f"student_{student.id}")
+    os.makedirs(current_app.config['UPLOAD_FOLDER'], exist_ok=True)
+    subdir = os.path.join(current_app.config['UPLOAD_FOLDER'], f"assignment_{assignment.id}", f"student_{student.id}")
     os.makedirs(subdir, exist_ok=True)
     filename = secure_filename(file.filename or f"submission_{student.id}_{assignment.id}")
     path = os.path.join(subdir, filename)
     file.save(path)
 
     # Public URL (served by static route from project root)
-    rel_dir = os.path.relpath(path, os.path.dirname(__file__))
-    public_url = f"/{rel_dir.replace('\\', '/')}"
+    rel_dir = os.path.relpath(path, os.path.dirname(__file__)).replace(os.sep, '/')
+    public_url = f"/{rel_dir}"
 
     submission = Submission(content=public_url, student_id=student.id, assignment_id=assignment.id)
     db.session.add(submission)
@@ -828,7 +944,7 @@ def submit_assignment_file():
 
     return jsonify({'message': 'Submission successful', 'submission_id': submission.id, 'file_url': public_url}), 201
 
-@app.route('/api/assignment/<int:assignment_id>/submissions', methods=['GET'])
+@bp.route('/api/assignment/<int:assignment_id>/submissions', methods=['GET'])
 def get_assignment_submissions(assignment_id):
     assignment = Assignment.query.get(assignment_id)
     if not assignment:
@@ -841,44 +957,166 @@ def get_assignment_submissions(assignment_id):
         if not teacher or teacher.role != 'teacher' or assignment.course.teacher_id != teacher.id:
             return jsonify({'error': 'Unauthorized'}), 403
 
-    subs = Submission.query.filter_by(assignment_id=assignment.id).order_by(Submission.submitted_at.desc()).all()
-    result = []
-    for s in subs:
-        result.append({
+    subs = Submission.query.filter_by(assignment_id=assignment.id).order_by(Submission.submitted_at.desc())
+    return stream_json_array(
+        {
             'id': s.id,
             'content': s.content,
             'student_id': s.student_id,
             'student_name': s.student.name,
-            'submitted_at': s.submitted_at.isoformat(),
+            'submitted_at': s.submitted_at,
             'grade': s.grade,
             'feedback': s.feedback
-        })
-    return jsonify(result), 200
+        } for s in subs
+    )
+
+# Batch API: several GETs in one round trip
+@bp.route('/api/batch', methods=['POST'])
+def batch_requests():
+    data = request.json or {}
+    items = data.get('requests')
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'requests must be a non-empty list'}), 400
+    if len(items) > current_app.config['BATCH_MAX_REQUESTS']:
+        return jsonify({'error': f"at most {current_app.config['BATCH_MAX_REQUESTS']} requests per batch"}), 400
+    paths = []
+    for item in items:
+        path = item.get('path') if isinstance(item, dict) else item
+        if not isinstance(path, str) or not path.startswith('/api/') or path.split('?')[0].rstrip('/') == '/api/batch':
+            return jsonify({'error': f'invalid path: {path!r}'}), 400
+        # Event streams stay open for NOTIFICATION_STREAM_TIMEOUT
+        if batch.match_endpoint(current_app, path) == 'lms.stream_notifications':
+            return jsonify({'error': f'streamed endpoints cannot be batched: {path!r}'}), 400
+        paths.append(path)
+    results = batch.run_batch(current_app._get_current_object(), paths,
+                              headers=batch.forwarded_headers(request.headers),
+                              parallel=bool(data.get('parallel')),
+                              max_workers=current_app.config['BATCH_MAX_WORKERS'])
+    return jsonify({'responses': [
+        {
+            'id': item.get('id', i) if isinstance(item, dict) else i,
+            'path': path,
+            'status': status,
+            'body': body
+        } for i, (item, path, (status, body)) in enumerate(zip(items, paths, results))
+    ]}), 200
 
 # Serve frontend files
-@app.route('/')
+@bp.route('/')
 def index():
     return send_from_directory('.', 'index.html')
 
-@app.route('/<path:path>')
+@bp.route('/<path:path>')
 def serve_static(path):
     return send_from_directory('.', path)
 
+# CLI commands
+db_cli = AppGroup('db', help='Database schema management.')
+
+@db_cli.command('init')
+def db_init():
+    """Create all tables and indexes that do not exist yet."""
+    db.create_all()
+    # create_all skips existing tables, so add indexes introduced since
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+    click.echo('Database initialised.')
+
+@db_cli.command('drop')
+@click.confirmation_option(prompt='This deletes all data. Continue?')
+def db_drop():
+    """Drop all tables."""
+    db.drop_all()
+    click.echo('Database dropped.')
+
+def purge_notifications(dry_run=False, max_batches=None):
+    config = current_app.config
+    stats = retention.purge_expired(
+        db.session, Notification,
+        archive_model=NotificationArchive if config['NOTIFICATION_ARCHIVE'] else None,
+        read_ttl_days=config['NOTIFICATION_READ_TTL_DAYS'],
+        unread_ttl_days=config['NOTIFICATION_UNREAD_TTL_DAYS'],
+        batch_size=config['NOTIFICATION_PURGE_BATCH'],
+        max_batches=max_batches, dry_run=dry_run)
+    if not dry_run and config['NOTIFICATION_ARCHIVE_TTL_DAYS']:
+        stats['archive_deleted'] = retention.purge_archive(
+            db.session, NotificationArchive, config['NOTIFICATION_ARCHIVE_TTL_DAYS'])
+    return stats
+
+notifications_cli = AppGroup('notifications', help='Notification retention and storage.')
+
+@notifications_cli.command('purge')
+@click.option('--dry-run', is_flag=True, help='Only count expired notifications.')
+@click.option('--max-batches', type=int, default=None, help='Stop after this many batches.')
+def notifications_purge(dry_run, max_batches):
+    """Archive and delete expired notifications in small batches."""
+    click.echo(purge_notifications(dry_run=dry_run, max_batches=max_batches))
+
+@notifications_cli.command('stats')
+def notifications_stats():
+    """Show live and archived notification counts."""
+    click.echo({
+        'live': Notification.query.count(),
+        'unread': Notification.query.filter_by(read=False).count(),
+        'archived': NotificationArchive.query.count(),
+        'expired': purge_notifications(dry_run=True)['expired'],
+    })
+
+@notifications_cli.command('partition')
+@click.option('--months-ahead', type=int, default=3, help='Future monthly partitions to keep ready.')
+@click.option('--convert', is_flag=True, help='Rebuild the table as a partitioned table first.')
+@click.option('--drop-expired', is_flag=True, help='Archive and drop partitions past the unread TTL.')
+def notifications_partition(months_ahead, convert, drop_expired):
+    """Manage monthly partitions of the notification table (PostgreSQL only)."""
+    if db.engine.dialect.name != 'postgresql':
+        raise click.ClickException('Partitioning requires PostgreSQL.')
+    table = Notification.__tablename__
+    with db.engine.begin() as conn:
+        if convert:
+            moved = retention.convert_to_partitioned(conn, table, months_ahead)
+            if moved is not None:
+                click.echo('Converted %s to monthly partitions (%d rows copied, old table kept as %s_unpartitioned).'
+                           % (table, moved, table))
+        if not retention.is_partitioned(conn, table):
+            raise click.ClickException('%s is not partitioned yet; run with --convert.' % table)
+        created = retention.ensure_partitions(conn, table, datetime.utcnow().date(), months_ahead)
+        click.echo('Partitions ready: %s' % ', '.join(created))
+        if drop_expired:
+            cutoff = datetime.utcnow().date() - timedelta(days=current_app.config['NOTIFICATION_UNREAD_TTL_DAYS'])
+            archive = NotificationArchive.__tablename__ if current_app.config['NOTIFICATION_ARCHIVE'] else None
+            dropped = retention.drop_expired_partitions(conn, table, cutoff, archive)
+            click.echo('Dropped partitions: %s' % (', '.join(dropped) or 'none'))
+
+def seed_demo():
+    existing_teacher = User.query.filter_by(role='teacher').first()
+    if not existing_teacher:
+        teacher = User(name='Demo Teacher', email='teacher@example.com', password=generate_password_hash('password'), role='teacher')
+        db.session.add(teacher)
+        db.session.commit()
+        existing_teacher = teacher
+    if Course.query.count() == 0 and existing_teacher:
+        courses = [
+            Course(title='Python Basics', description='Learn Python fundamentals: variables, loops, functions, and modules.', duration='6 weeks', teacher_id=existing_teacher.id),
+            Course(title='Web Development 101', description='Intro to HTML, CSS, JavaScript, and building responsive web pages.', duration='8 weeks', teacher_id=existing_teacher.id),
+            Course(title='Data Science Intro', description='Foundations of data analysis, visualization, and basic machine learning.', duration='10 weeks', teacher_id=existing_teacher.id)
+        ]
+        db.session.add_all(courses)
+        db.session.commit()
+
+@click.command('seed')
+@click.option('--scale', type=click.Choice(['small', 'medium', 'large']), default=None,
+              help='Also load a synthetic dataset of this size (see datagen.py).')
+@click.option('--seed', 'rng_seed', type=int, default=42, help='Random seed for --scale.')
+@with_appcontext
+def seed_command(scale, rng_seed):
+    """Insert the demo teacher and courses, optionally plus synthetic data."""
+    seed_demo()
+    if scale:
+        from datagen import SCALES, generate
+        generate(seed=rng_seed, log=click.echo, **SCALES[scale])
+    click.echo('Seed data loaded.')
+
 if __name__ == '__main__':
-    with app.app_context():
-        db.create_all()
-        existing_teacher = User.query.filter_by(role='teacher').first()
-        if not existing_teacher:
-            teacher = User(name='Demo Teacher', email='teacher@example.com', password=generate_password_hash('password'), role='teacher')
-            db.session.add(teacher)
-            db.session.commit()
-            existing_teacher = teacher
-        if Course.query.count() == 0 and existing_teacher:
-            courses = [
-                Course(title='Python Basics', description='Learn Python fundamentals: variables, loops, functions, and modules.', duration='6 weeks', teacher_id=existing_teacher.id),
-                Course(title='Web Development 101', description='Intro to HTML, CSS, JavaScript, and building responsive web pages.', duration='8 weeks', teacher_id=existing_teacher.id),
-                Course(title='Data Science Intro', description='Foundations of data analysis, visualization, and basic machine learning.', duration='10 weeks', teacher_id=existing_teacher.id)
-            ]
-            db.session.add_all(courses)
-            db.session.commit()
-    app.run(debug=True)
\ No newline at end of file
+    # Development server only; run `flask db init` and `flask seed` first.
+    create_app().run(debug=True)
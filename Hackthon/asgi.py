@@ -0,0 +1,538 @@
+"""ASGI entry point: serves long-lived and I/O-bound routes on an event loop.
+
+    pip install -r requirements-async.txt
+    uvicorn asgi:app --workers 4
+
+Under WSGI every open notification stream, upload or download from a slow
+client holds a worker thread for its whole duration. Here these routes
+from app.py are served without one:
+
+  * GET /api/notifications/<id>/stream   server-sent events, fed by one
+                                           poller per process (NotificationHub)
+  * GET /api/notifications/<id>          streamed from the async DB driver
+  * static files and /uploads            read with aiofiles, with
+                                           conditional and range requests
+  * POST /api/submit-file, POST /api/course/<id>/materials
+                                           the body is received and spooled to
+                                           disk asynchronously before the view runs
+
+Everything else goes to the unchanged Flask app the same way: the request
+body is received on the event loop, then the app runs on a pool of
+ASYNC_WSGI_THREADS threads and its response is sent as it is produced.
+"""
+import asyncio
+import io
+import logging
+import mimetypes
+import stat
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from urllib.parse import parse_qs
+
+import aiofiles
+import aiofiles.os
+import aiofiles.tempfile
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import http_date, is_resource_modified, parse_accept_header, parse_range_header
+from werkzeug.utils import safe_join
+
+from aiodb import AsyncDatabase, as_datetime
+from app import create_app, db, sse_event
+from compression import STREAM_ENCODERS
+from jsonprovider import STREAM_BATCH
+
+logger = logging.getLogger('lms.asgi')
+
+STATIC_ENDPOINTS = ('static', 'lms.index', 'lms.serve_static')
+UPLOAD_ENDPOINTS = ('lms.submit_assignment_file', 'lms.upload_material')
+
+NOTIFICATION_COLUMNS = 'id, user_id, title, message, created_at, read'
+
+
+def _notification(row):
+    return {
+        'id': row['id'],
+        'title': row['title'],
+        'message': row['message'],
+        'created_at': as_datetime(row['created_at']),
+        'read': bool(row['read']) if row['read'] is not None else None,
+    }
+
+
+class NotificationHub(object):
+    """One poller per process fans new notifications out to the open streams,
+    so the query rate does not grow with the number of connections."""
+
+    def __init__(self, database, interval):
+        self.db = database
+        self.interval = interval
+        self.subscribers = {}
+        self._task = None
+
+    @property
+    def open_streams(self):
+        return sum(len(queues) for queues in self.subscribers.values())
+
+    def subscribe(self, user_id):
+        queue = asyncio.Queue()
+        self.subscribers.setdefault(user_id, set()).add(queue)
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+        return queue
+
+    def unsubscribe(self, user_id, queue):
+        queues = self.subscribers.get(user_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self.subscribers[user_id]
+
+    async def _run(self):
+        last_id = await self.db.scalar('SELECT max(id) FROM notification') or 0
+        while self.subscribers:
+            try:
+                rows = await self.db.fetch(
+                    'SELECT %s FROM notification WHERE id > :after ORDER BY id LIMIT 500' % NOTIFICATION_COLUMNS,
+                    {'after': last_id})
+            except Exception:
+                logger.exception('notification poll failed')
+                rows = []
+            for row in rows:
+                last_id = max(last_id, row['id'])
+                for queue in self.subscribers.get(row['user_id'], ()):
+                    queue.put_nowait(_notification(row))
+            if len(rows) < 500:
+                await asyncio.sleep(self.interval)
+
+
+class AsyncApp(object):
+    """ASGI application wrapping the Flask app.
+
+    Config keys (all optional):
+        ASYNC_DB_POOL_SIZE     async driver connections per process (10)
+        ASYNC_WSGI_THREADS     threads running the Flask views (32)
+        ASYNC_UPLOAD_SPOOL     upload bytes kept in memory before spooling to disk (1 MB)
+        ASYNC_FILE_CHUNK       read/send size for static files (64 KB)
+        ASYNC_STREAM_BUFFER    response chunks a view may run ahead of the client (16)
+    """
+
+    def __init__(self, app):
+        app.config.setdefault('ASYNC_DB_POOL_SIZE', 10)
+        app.config.setdefault('ASYNC_WSGI_THREADS', 32)
+        app.config.setdefault('ASYNC_UPLOAD_SPOOL', 1024 * 1024)
+        app.config.setdefault('ASYNC_FILE_CHUNK', 64 * 1024)
+        app.config.setdefault('ASYNC_STREAM_BUFFER', 16)
+        self.app = app
+        self.executor = ThreadPoolExecutor(app.config['ASYNC_WSGI_THREADS'], thread_name_prefix='wsgi')
+        with app.app_context():
+            url = db.engine.url
+        self.db = AsyncDatabase(url, app.config['ASYNC_DB_POOL_SIZE'])
+        self.hub = NotificationHub(self.db, app.config['NOTIFICATION_STREAM_INTERVAL'])
+        self.handlers = {
+            'lms.get_notifications': self.notifications,
+            'lms.stream_notifications': self.notification_stream,
+        }
+        self.requests = None
+        app.extensions['asgi'] = self
+
+        instrumentation = app.extensions.get('instrumentation')
+        if instrumentation is not None:
+            registry = instrumentation.registry
+            self.requests = registry.counter('lms_async_requests_total',
+                                             'Requests served on the event loop, by handler.', ('handler',))
+            registry.gauge('lms_async_open_streams', 'Open notification streams.', (),
+                           lambda: {(): self.hub.open_streams})
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        if scope['type'] != 'http':
+            return
+        try:
+            rule, args = self.app.url_map.bind('', script_name=scope.get('root_path') or None).match(
+                scope['path'], scope['method'], return_rule=True)
+        except HTTPException:
+            rule, args = None, {}
+        endpoint = rule.endpoint if rule is not None else None
+
+        if endpoint in self.handlers:
+            self._count('notifications' if endpoint == 'lms.get_notifications' else 'stream')
+            return await self.handlers[endpoint](scope, receive, send, **args)
+        if endpoint in STATIC_ENDPOINTS and scope['method'] in ('GET', 'HEAD'):
+            filename = args.get('filename') or args.get('path') or 'index.html'
+            if await self.static_file(scope, send, filename):
+                self._count('static')
+                return
+        elif endpoint in UPLOAD_ENDPOINTS:
+            self._count('upload')
+        return await self.wsgi(scope, receive, send)
+
+    def _count(self, handler):
+        if self.requests is not None:
+            self.requests.inc(1, handler)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                asyncio.get_running_loop().set_default_executor(self.executor)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.db.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    # Helpers
+
+    @staticmethod
+    def _headers(scope):
+        return {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope['headers']}
+
+    def _environ(self, scope, body, length):
+        """PEP 3333 environ for a request whose body is already buffered."""
+        server = scope.get('server') or ('localhost', 80)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope['query_string'].decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1] or 80),
+            'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+            'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+            'CONTENT_LENGTH': str(length),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope['headers']:
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name == 'CONTENT_LENGTH':
+                continue
+            if name != 'CONTENT_TYPE':
+                name = 'HTTP_' + name
+            environ[name] = environ[name] + ',' + value if name in environ else value
+        return environ
+
+    def _stream_wsgi(self, environ, loop, queue, credit, stop):
+        """Run the Flask app on this executor thread, handing the status and each
+        body chunk to the event loop as they are produced.
+
+        At most ASYNC_STREAM_BUFFER chunks wait unsent (`credit`). The result is
+        iterated and closed on this one thread, as stream_with_context needs.
+        """
+        def emit(item):
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'], started['headers'] = status, headers
+
+        try:
+            result = self.app(environ, start_response)
+            try:
+                emit((int(started['status'].split()[0]), started['headers']))
+                for data in result:
+                    if not data:
+                        continue
+                    credit.acquire()
+                    if stop.is_set():
+                        break
+                    emit(data)
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+        except Exception as exc:
+            emit(exc)
+        else:
+            emit(None)
+
+    async def _respond(self, send, environ):
+        """Send the Flask app's response for `environ` chunk by chunk."""
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        credit, stop = threading.Semaphore(self.app.config['ASYNC_STREAM_BUFFER']), threading.Event()
+        producer = loop.run_in_executor(self.executor, self._stream_wsgi, environ, loop, queue, credit, stop)
+        try:
+            started = False
+            while True:
+                item = await queue.get()
+                if isinstance(item, Exception):
+                    raise item
+                if item is None:
+                    break
+                if not started:
+                    await self._start(send, *item)
+                    started = True
+                    continue
+                await send({'type': 'http.response.body', 'body': item, 'more_body': True})
+                credit.release()
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            # Wake a producer waiting for credit so it stops and closes the response
+            stop.set()
+            credit.release()
+            await producer
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    @staticmethod
+    async def _send(send, status, headers, body=b'', more_body=False):
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(k.encode('latin-1'), str(v).encode('latin-1')) for k, v in headers]})
+        await send({'type': 'http.response.body', 'body': body, 'more_body': more_body})
+
+    async def _begin(self, scope, headers):
+        """Run Flask's before- and after-request hooks for a route answered here, so
+        rate limiting, shedding, CORS, Vary and request metrics apply as under WSGI.
+
+        Returns (response, admitted). A refused request gets the complete Flask
+        response; otherwise it carries only the status and headers to send, and
+        closing it once the body is done records the request's metrics and
+        its latency sample for shedding.
+        """
+        def begin():
+            with self.app.request_context(self._environ(scope, io.BytesIO(), 0)):
+                response = self.app.preprocess_request()
+                admitted = response is None
+                if admitted:
+                    response = self.app.response_class(iter(()), headers=headers)
+                response = self.app.finalize_request(response)
+                limiter = self.app.extensions.get('ratelimit')
+                if admitted and limiter is not None:
+                    # The body is sent after teardown; count the request as in flight until then
+                    response.call_on_close(limiter.detach())
+                return response, admitted
+
+        return await self._run(begin)
+
+    @staticmethod
+    async def _start(send, status, headers):
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(k.encode('latin-1'), str(v).encode('latin-1')) for k, v in headers]})
+
+    # Handlers
+
+    async def notifications(self, scope, receive, send, user_id):
+        provider = self.app.extensions['json_provider']
+        headers = [('Content-Type', provider.mimetype)]
+        encoder = self._stream_encoder(scope)
+        if encoder is not None:
+            headers.append(('Content-Encoding', encoder[0]))
+        response, admitted = await self._begin(scope, headers)
+        if not admitted:
+            return await self._send(send, response.status_code, response.headers.items(), response.get_data())
+        try:
+            await self._start(send, response.status_code, response.headers.items())
+            await self._notification_list(send, user_id, provider, encoder)
+        finally:
+            response.close()
+
+    async def _notification_list(self, send, user_id, provider, encoder):
+        async def chunk(data):
+            if encoder is not None:
+                data = encoder[1].compress(data)
+            if data:
+                await send({'type': 'http.response.body', 'body': data, 'more_body': True})
+
+        rows = self.db.iterate('SELECT %s FROM notification WHERE user_id = :user_id ORDER BY created_at DESC'
+                               % NOTIFICATION_COLUMNS, {'user_id': user_id}, STREAM_BATCH)
+        prefix, batch = b'[', []
+        async for row in rows:
+            batch.append(provider.dumps_bytes(_notification(row)))
+            if len(batch) >= STREAM_BATCH:
+                await chunk(prefix + b','.join(batch))
+                prefix, batch = b',', []
+        if batch:
+            await chunk(prefix + b','.join(batch) + b']\n')
+        else:
+            await chunk((b'[' if prefix == b'[' else b'') + b']\n')
+        await send({'type': 'http.response.body', 'body': encoder[1].finish() if encoder else b''})
+
+    def _stream_encoder(self, scope):
+        compression = self.app.extensions.get('compression')
+        if compression is None or not (compression.enabled and compression.streams and compression.encoders):
+            return None
+        accept = parse_accept_header(self._headers(scope).get('accept-encoding'))
+        encoding = accept.best_match([name for name, _ in compression.encoders])
+        if encoding is None or accept[encoding] == 0:
+            return None
+        return encoding, STREAM_ENCODERS[encoding](compression.levels[encoding])
+
+    async def notification_stream(self, scope, receive, send, user_id):
+        response, admitted = await self._begin(scope, [('Content-Type', 'text/event-stream'),
+                                                       ('Cache-Control', 'no-cache'), ('X-Accel-Buffering', 'no')])
+        if not admitted:
+            return await self._send(send, response.status_code, response.headers.items(), response.get_data())
+        try:
+            await self._event_stream(scope, receive, send, response, user_id)
+        finally:
+            response.close()
+
+    async def _event_stream(self, scope, receive, send, response, user_id):
+        config = self.app.config
+        provider = self.app.extensions['json_provider']
+        headers = self._headers(scope)
+        query = parse_qs(scope['query_string'].decode('latin-1'))
+        last_id = headers.get('last-event-id') or (query.get('after') or [None])[0]
+        last_id = int(last_id) if last_id and last_id.isdigit() else None
+        queue = self.hub.subscribe(user_id)
+
+        async def watch_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            queue.put_nowait(None)
+
+        async def event(item):
+            data = sse_event(item['id'], provider.dumps(item)).encode('utf-8')
+            await send({'type': 'http.response.body', 'body': data, 'more_body': True})
+
+        watcher = asyncio.ensure_future(watch_disconnect())
+        try:
+            resume = last_id is not None
+            if not resume:
+                last_id = await self.db.scalar('SELECT max(id) FROM notification WHERE user_id = :user_id',
+                                               {'user_id': user_id}) or 0
+            await self._start(send, response.status_code, response.headers.items())
+            await send({'type': 'http.response.body', 'more_body': True,
+                        'body': ('retry: %d\n\n' % (config['NOTIFICATION_STREAM_INTERVAL'] * 1000)).encode()})
+            # Catch up in id order before reading the queue; anything the hub
+            # queued in the meantime is skipped there by id.
+            while resume:
+                missed = await self.db.fetch(
+                    'SELECT %s FROM notification WHERE user_id = :user_id AND id > :after ORDER BY id LIMIT 100'
+                    % NOTIFICATION_COLUMNS, {'user_id': user_id, 'after': last_id})
+                for row in missed:
+                    last_id = row['id']
+                    await event(_notification(row))
+                resume = len(missed) == 100
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + config['NOTIFICATION_STREAM_TIMEOUT']
+            while loop.time() < deadline:
+                try:
+                    item = await asyncio.wait_for(queue.get(), min(config['NOTIFICATION_STREAM_HEARTBEAT'],
+                                                                   max(deadline - loop.time(), 0)))
+                except asyncio.TimeoutError:
+                    await send({'type': 'http.response.body', 'body': b': keepalive\n\n', 'more_body': True})
+                    continue
+                if item is None:
+                    return
+                if item['id'] <= last_id:
+                    continue
+                last_id = item['id']
+                await event(item)
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            watcher.cancel()
+            self.hub.unsubscribe(user_id, queue)
+
+    async def static_file(self, scope, send, filename):
+        """Send a file below the app root; False if there is none (Flask answers then)."""
+        path = safe_join(self.app.root_path, filename)
+        if path is None:
+            return False
+        try:
+            st = await aiofiles.os.stat(path)
+        except OSError:
+            return False
+        if not stat.S_ISREG(st.st_mode):
+            return False
+
+        mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        if mimetype.startswith('text/') or mimetype == 'application/javascript':
+            mimetype += '; charset=utf-8'
+        etag = '%x-%x' % (int(st.st_mtime * 1000), st.st_size)
+        last_modified = http_date(st.st_mtime)
+        headers = [('Content-Type', mimetype), ('ETag', '"%s"' % etag), ('Last-Modified', last_modified),
+                   ('Cache-Control', 'no-cache'), ('Accept-Ranges', 'bytes')]
+        request_headers = self._headers(scope)
+        environ = {'REQUEST_METHOD': 'GET'}
+        for name in ('if-none-match', 'if-modified-since'):
+            if name in request_headers:
+                environ['HTTP_' + name.upper().replace('-', '_')] = request_headers[name]
+        if len(environ) > 1 and not is_resource_modified(
+                environ, etag=etag, last_modified=datetime.fromtimestamp(int(st.st_mtime), timezone.utc)):
+            await self._send(send, 304, headers)
+            return True
+
+        start, end, status = 0, st.st_size, 200
+        ranges = parse_range_header(request_headers.get('range'))
+        if_range = request_headers.get('if-range')
+        if ranges is not None and if_range in (None, '"%s"' % etag, last_modified):
+            bounds = ranges.range_for_length(st.st_size)
+            if bounds is None:
+                await self._send(send, 416, [('Content-Range', 'bytes */%d' % st.st_size)])
+                return True
+            start, end, status = bounds[0], bounds[1], 206
+            headers.append(('Content-Range', 'bytes %d-%d/%d' % (start, end - 1, st.st_size)))
+        headers.append(('Content-Length', str(end - start)))
+        if scope['method'] == 'HEAD':
+            await self._send(send, status, headers)
+            return True
+
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(k.encode('latin-1'), v.encode('latin-1')) for k, v in headers]})
+        size = self.app.config['ASYNC_FILE_CHUNK']
+        async with aiofiles.open(path, 'rb') as fh:
+            await fh.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                data = await fh.read(min(size, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                await send({'type': 'http.response.body', 'body': data, 'more_body': remaining > 0})
+        if remaining > 0:
+            await send({'type': 'http.response.body', 'body': b''})
+        return True
+
+    async def wsgi(self, scope, receive, send):
+        """Receive the whole body without a thread, then run the Flask app on one."""
+        limit = self.app.config.get('MAX_CONTENT_LENGTH')
+        spool = self.app.config['ASYNC_UPLOAD_SPOOL']
+        memory, spooled, length = io.BytesIO(), None, 0
+        try:
+            while True:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    return
+                data = message.get('body', b'')
+                length += len(data)
+                if limit is not None and length > limit:
+                    # Flask answers 413 from CONTENT_LENGTH without reading the body
+                    break
+                if spooled is None and length > spool:
+                    spooled = await aiofiles.tempfile.NamedTemporaryFile('wb', delete=False)
+                    await spooled.write(memory.getvalue())
+                    memory = None
+                if spooled is not None:
+                    await spooled.write(data)
+                else:
+                    memory.write(data)
+                if not message.get('more_body'):
+                    break
+            if spooled is not None:
+                await spooled.close()
+                body = await self._run(open, spooled.name, 'rb')
+            else:
+                memory.seek(0)
+                body = memory
+            try:
+                await self._respond(send, self._environ(scope, body, length))
+            finally:
+                body.close()
+        finally:
+            if spooled is not None:
+                await aiofiles.os.remove(spooled.name)
+
+
+app = AsyncApp(create_app())
@@ -0,0 +1,97 @@
+"""Internal dispatch for the /api/batch endpoint.
+
+Each sub-request is a GET run against the app's own URL map and view
+functions without going back through the HTTP stack. Run sequentially
+(the default), sub-requests share the caller's app context, so they reuse
+its database session and connection and their SQL is counted on the
+batch request. In parallel mode they run on a bounded, process-wide
+thread pool, each with its own app context and session.
+
+Sub-requests skip before_request, so the rate limiter's shedding and token
+buckets are applied here for each one, by its own route and priority.
+Server-sent event streams never finish and are refused.
+"""
+import json
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import g, request
+from werkzeug.exceptions import HTTPException
+
+# Headers a sub-request inherits from the batch request
+FORWARDED_HEADERS = ('Cookie', 'Authorization', 'Accept-Language', 'X-Forwarded-For')
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _pool(max_workers):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='batch')
+        return _executor
+
+
+def forwarded_headers(headers):
+    return {name: headers[name] for name in FORWARDED_HEADERS if name in headers}
+
+
+def match_endpoint(app, path):
+    """The endpoint a GET of `path` routes to, or None."""
+    adapter = app.url_map.bind('localhost')
+    try:
+        return adapter.match(path.split('?')[0], method='GET')[0]
+    except HTTPException:
+        return None
+
+
+def dispatch_get(app, path, headers=None):
+    """Run one GET sub-request in-process. Returns (status, body)."""
+    with app.test_request_context(path, method='GET', headers=headers or {}):
+        stats = g.get('_lms_stats')
+        if stats is not None:
+            # Queries still add up on the batch request, but N+1 detection
+            # looks at each sub-request on its own.
+            stats.shapes, stats.warned = Counter(), set()
+        try:
+            if request.routing_exception is not None:
+                raise request.routing_exception
+            limiter = app.extensions.get('ratelimit')
+            rejected = limiter.admit(app, request.url_rule.rule) if limiter is not None else None
+            if rejected is not None:
+                return rejected.status_code, rejected.get_json()
+            view = app.view_functions[request.url_rule.endpoint]
+            response = app.make_response(view(**request.view_args))
+            if response.mimetype == 'text/event-stream':
+                response.close()
+                return 400, {'error': 'Streamed responses cannot be batched'}
+            data = response.get_data()
+        except HTTPException as exc:
+            return exc.code, {'error': exc.description}
+        except Exception:
+            app.logger.exception('batch sub-request failed: GET %s', path)
+            sqlalchemy = app.extensions.get('sqlalchemy')
+            if sqlalchemy is not None:
+                sqlalchemy.db.session.rollback()
+            return 500, {'error': 'Internal server error'}
+    if response.is_json:
+        provider = app.extensions.get('json_provider')
+        loads = provider.loads if provider is not None else json.loads
+        return response.status_code, loads(data) if data else None
+    return response.status_code, data.decode(response.charset, 'replace')
+
+
+def _dispatch_in_thread(app, path, headers):
+    with app.app_context():
+        return dispatch_get(app, path, headers)
+
+
+def run_batch(app, paths, headers=None, parallel=False, max_workers=4):
+    """Dispatch every path and return [(status, body)] in the same order."""
+    if not parallel or len(paths) < 2:
+        return [dispatch_get(app, path, headers) for path in paths]
+    pool = _pool(max_workers)
+    futures = [pool.submit(_dispatch_in_thread, app, path, headers) for path in paths]
+    return [future.result() for future in futures]
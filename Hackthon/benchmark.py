@@ -0,0 +1,410 @@
+"""Benchmark harness for the LMS API.
+
+Drives the real routes either in-process through the Flask test client or
+over HTTP from several worker processes, and reports p50/p95/p99 latency
+and SQL statements per request (read from the X-SQL-Count header that
+instrumentation.py adds) for each endpoint. Results are written as JSON so
+runs on different commits can be compared with --compare.
+
+    python datagen.py --scale medium --database sqlite:///bench.db --reset
+    python benchmark.py --database sqlite:///bench.db --output before.json
+    python benchmark.py --url http://localhost:5000 --processes 8 --output http.json
+    python benchmark.py --database sqlite:///bench.db --compare before.json
+    python benchmark.py --endpoint courses --startup 10
+
+--capacity measures how many long-lived connections (live notification
+streams by default) a running server holds at once and how quickly it
+still answers a probe request meanwhile; run it against the WSGI and the
+ASGI deployment to compare them:
+
+    python benchmark.py --url http://localhost:5000 --capacity 100,500,2000 --output capacity.json
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from app import Assignment, Course, User, create_app, db
+
+# (name, method, path template, json body template)
+ENDPOINTS = [
+    ('courses', 'GET', '/api/courses', None),
+    ('course_detail', 'GET', '/api/course/{course_id}', None),
+    ('my_courses', 'GET', '/api/my-courses/{student_id}', None),
+    ('course_students', 'GET', '/api/course-students/{course_id}', None),
+    ('course_assignments', 'GET', '/api/course/{course_id}/assignments', None),
+    ('student_assignments', 'GET', '/api/student/{student_id}/assignments', None),
+    ('student_grades', 'GET', '/api/grades/student/{student_id}', None),
+    ('assignment_submissions', 'GET', '/api/assignment/{assignment_id}/submissions', None),
+    ('attendance_summary', 'GET', '/api/attendance/student/{student_id}', None),
+    ('course_attendance', 'GET', '/api/attendance/course/{course_id}', None),
+    ('discussion', 'GET', '/api/course/{course_id}/discussion', None),
+    ('materials', 'GET', '/api/course/{course_id}/materials', None),
+    ('completion', 'GET', '/api/course/{course_id}/completion?student_id={student_id}', None),
+    ('notifications', 'GET', '/api/notifications/{student_id}', None),
+    ('login', 'POST', '/api/login', {'email': '{email}', 'password': 'password'}),
+]
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def summarise(samples):
+    """samples: list of (elapsed_seconds, status, sql_count or None)."""
+    latencies = [s[0] * 1000.0 for s in samples]
+    queries = [s[2] for s in samples if s[2] is not None]
+    errors = sum(1 for s in samples if s[1] >= 500 or s[1] == 0)
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'rate_limited': sum(1 for s in samples if s[1] == 429),
+        'mean_ms': round(sum(latencies) / len(latencies), 3) if latencies else None,
+        'p50_ms': round(percentile(latencies, 50), 3) if latencies else None,
+        'p95_ms': round(percentile(latencies, 95), 3) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99), 3) if latencies else None,
+        'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+    }
+
+
+def sample_ids(limit=500):
+    """Pick ids that exist in the current database. Needs an app context."""
+    students = db.session.query(User.id, User.email).filter_by(role='student').limit(limit).all()
+    return {
+        'student': [(sid, email) for sid, email in students],
+        'course': [row[0] for row in db.session.query(Course.id).limit(limit)],
+        'assignment': [row[0] for row in db.session.query(Assignment.id).limit(limit)],
+    }
+
+
+def build_requests(ids, endpoints, iterations, seed):
+    rng = random.Random(seed)
+    plan = []
+    for name, method, path, body in endpoints:
+        for _ in range(iterations):
+            student_id, email = rng.choice(ids['student']) if ids['student'] else (1, '')
+            values = {
+                'student_id': student_id,
+                'email': email,
+                'course_id': rng.choice(ids['course']) if ids['course'] else 1,
+                'assignment_id': rng.choice(ids['assignment']) if ids['assignment'] else 1,
+            }
+            payload = None
+            if body is not None:
+                payload = {k: v.format(**values) if isinstance(v, str) else v for k, v in body.items()}
+            plan.append((name, method, path.format(**values), payload))
+    rng.shuffle(plan)
+    return plan
+
+
+def _sql_count(headers):
+    value = headers.get('X-SQL-Count')
+    return int(value) if value is not None else None
+
+
+def run_inprocess(app, plan, warmup):
+    client = app.test_client()
+    # Streamed responses carry no X-SQL-Count (their queries run after the
+    # headers are sent); read their count from the metrics instead.
+    instrumentation = app.extensions.get('instrumentation')
+    results = {}
+    for i, (name, method, path, payload) in enumerate(plan):
+        queries_before = instrumentation.request_queries.total()[0] if instrumentation else None
+        began = time.perf_counter()
+        response = client.open(path, method=method, json=payload)
+        # Streamed bodies run their queries and serialisation while being read
+        response.get_data()
+        response.close()
+        elapsed = time.perf_counter() - began
+        sql = _sql_count(response.headers)
+        if sql is None and instrumentation is not None:
+            sql = int(instrumentation.request_queries.total()[0] - queries_before)
+        if i >= warmup:
+            results.setdefault(name, []).append((elapsed, response.status_code, sql))
+    return results
+
+
+def _http_worker(args):
+    base_url, plan = args
+    results = {}
+    for name, method, path, payload in plan:
+        data = json.dumps(payload).encode('utf-8') if payload is not None else None
+        req = urllib.request.Request(base_url.rstrip('/') + path, data=data, method=method)
+        if data is not None:
+            req.add_header('Content-Type', 'application/json')
+        began = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req, timeout=60) as response:
+                response.read()
+                status, headers = response.status, response.headers
+        except urllib.error.HTTPError as exc:
+            exc.read()
+            status, headers = exc.code, exc.headers
+        except OSError:
+            status, headers = 0, {}
+        elapsed = time.perf_counter() - began
+        results.setdefault(name, []).append((elapsed, status, _sql_count(headers)))
+    return results
+
+
+def run_http(base_url, plan, processes):
+    chunks = [plan[i::processes] for i in range(processes)]
+    merged = {}
+    began = time.perf_counter()
+    with multiprocessing.Pool(processes) as pool:
+        for results in pool.imap_unordered(_http_worker, [(base_url, c) for c in chunks]):
+            for name, samples in results.items():
+                merged.setdefault(name, []).extend(samples)
+    return merged, time.perf_counter() - began
+
+
+async def _open_stream(host, port, path, timeout):
+    """Open a connection and wait for the response head; (writer, status, seconds)."""
+    began = time.perf_counter()
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return None, 0, time.perf_counter() - began
+    writer.write(('GET %s HTTP/1.1\r\nHost: %s:%d\r\nAccept: text/event-stream\r\n\r\n'
+                  % (path, host, port)).encode('latin-1'))
+    try:
+        line = await asyncio.wait_for(reader.readline(), max(timeout - (time.perf_counter() - began), 0.01))
+        status = int(line.split()[1])
+    except (OSError, asyncio.TimeoutError, IndexError, ValueError):
+        status = 0
+    return writer, status, time.perf_counter() - began
+
+
+async def _probe(host, port, path, timeout):
+    began = time.perf_counter()
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        writer.write(('GET %s HTTP/1.1\r\nHost: %s:%d\r\nConnection: close\r\n\r\n'
+                      % (path, host, port)).encode('latin-1'))
+        data = await asyncio.wait_for(reader.read(), timeout)
+        writer.close()
+        status = int(data.split(None, 2)[1])
+    except (OSError, asyncio.TimeoutError, IndexError, ValueError):
+        status = 0
+    return time.perf_counter() - began, status
+
+
+async def _capacity_step(base_url, paths, probe_path, hold, timeout):
+    url = urllib.parse.urlsplit(base_url)
+    host, port = url.hostname, url.port or 80
+    opened = await asyncio.gather(*[_open_stream(host, port, path, timeout) for path in paths])
+    probes = []
+    deadline = time.perf_counter() + hold
+    while time.perf_counter() < deadline:
+        probes.append(await _probe(host, port, probe_path, timeout))
+        await asyncio.sleep(0.1)
+    for writer, _, _ in opened:
+        if writer is not None:
+            writer.close()
+    connect = [seconds * 1000.0 for _, status, seconds in opened if status == 200]
+    latencies = [seconds * 1000.0 for seconds, status in probes if status == 200]
+    return {
+        'connections': len(paths),
+        'established': len(connect),
+        'rejected': sum(1 for _, status, _ in opened if status not in (0, 200)),
+        'timed_out': sum(1 for _, status, _ in opened if status == 0),
+        'connect_p50_ms': round(percentile(connect, 50), 3) if connect else None,
+        'connect_p95_ms': round(percentile(connect, 95), 3) if connect else None,
+        'probes': len(probes),
+        'probe_errors': len(probes) - len(latencies),
+        'probe_p50_ms': round(percentile(latencies, 50), 3) if latencies else None,
+        'probe_p95_ms': round(percentile(latencies, 95), 3) if latencies else None,
+    }
+
+
+def _raise_fd_limit():
+    try:
+        import resource
+    except ImportError:  # not on Windows
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def run_capacity(base_url, ids, steps, path, probe_path, hold, timeout, seed):
+    """Hold `n` streams open for each n in steps while probing probe_path."""
+    _raise_fd_limit()
+    rng = random.Random(seed)
+    students = [sid for sid, _ in ids['student']] or [1]
+    results = []
+    for n in steps:
+        paths = [path.format(student_id=rng.choice(students)) for _ in range(n)]
+        results.append(asyncio.run(_capacity_step(base_url, paths, probe_path, hold, timeout)))
+    return results
+
+
+STARTUP_SNIPPET = (
+    'import time; t = time.perf_counter(); import wsgi; '
+    'print(time.perf_counter() - t, wsgi.app.config["STARTUP_SECONDS"])'
+)
+
+
+def measure_startup(runs):
+    """Time cold worker start-up (import + create_app) in fresh interpreters."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    imports, factory = [], []
+    for _ in range(runs):
+        out = subprocess.check_output([sys.executable, '-c', STARTUP_SNIPPET], cwd=here)
+        total, in_factory = out.decode().split()[-2:]
+        imports.append(float(total) * 1000.0)
+        factory.append(float(in_factory) * 1000.0)
+    return {
+        'runs': runs,
+        'import_p50_ms': round(percentile(imports, 50), 3),
+        'import_max_ms': round(max(imports), 3),
+        'create_app_p50_ms': round(percentile(factory, 50), 3),
+    }
+
+
+def _git_commit():
+    try:
+        out = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                      cwd=os.path.dirname(os.path.abspath(__file__)),
+                                      stderr=subprocess.DEVNULL)
+        return out.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline_path):
+    with open(baseline_path) as fh:
+        baseline = json.load(fh)
+    print('%-24s %12s %12s %8s %10s %10s' % ('endpoint', 'p95 before', 'p95 after', 'change', 'sql before', 'sql after'))
+    for name, stats in sorted(current['endpoints'].items()):
+        old = baseline.get('endpoints', {}).get(name)
+        if not old or not old.get('p95_ms') or stats.get('p95_ms') is None:
+            continue
+        change = (stats['p95_ms'] - old['p95_ms']) / old['p95_ms'] * 100.0
+        print('%-24s %12.2f %12.2f %+7.1f%% %10s %10s' % (
+            name, old['p95_ms'], stats['p95_ms'], change,
+            old.get('queries_per_request'), stats.get('queries_per_request')))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark LMS API endpoints.')
+    parser.add_argument('--database', help='SQLAlchemy URL (defaults to DATABASE_URL / sqlite:///lms.db)')
+    parser.add_argument('--url', help='benchmark a running server over HTTP instead of in-process')
+    parser.add_argument('--processes', type=int, default=4, help='HTTP client processes')
+    parser.add_argument('--iterations', type=int, default=50, help='requests per endpoint')
+    parser.add_argument('--warmup', type=int, default=20, help='in-process requests to discard')
+    parser.add_argument('--endpoint', action='append', help='only run these endpoints')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--compare', help='print the change against an earlier JSON result')
+    parser.add_argument('--startup', type=int, default=0, metavar='RUNS',
+                        help='also time worker start-up over this many fresh processes')
+    parser.add_argument('--capacity', metavar='N[,N...]',
+                        help='with --url: hold this many concurrent streams open (one step per value)')
+    parser.add_argument('--capacity-path', default='/api/notifications/{student_id}/stream',
+                        help='long-lived request to open for --capacity')
+    parser.add_argument('--probe', default='/api/courses', help='request timed while the streams are open')
+    parser.add_argument('--hold', type=float, default=10.0, help='seconds to hold each --capacity step')
+    parser.add_argument('--timeout', type=float, default=10.0, help='--capacity connect/response timeout')
+    args = parser.parse_args(argv)
+    if args.capacity and not args.url:
+        parser.error('--capacity needs --url')
+
+    # Measure the routes, not the limiter
+    config = {'RATELIMIT_ENABLED': False}
+    if args.database:
+        config['SQLALCHEMY_DATABASE_URI'] = args.database
+    app = create_app(config)
+    endpoints = [e for e in ENDPOINTS if not args.endpoint or e[0] in args.endpoint]
+    with app.app_context():
+        ids = sample_ids()
+
+    if args.capacity:
+        steps = [int(n) for n in args.capacity.split(',')]
+        result = {
+            'meta': {
+                'commit': _git_commit(),
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                'mode': 'capacity',
+                'target': args.url,
+                'path': args.capacity_path,
+                'probe': args.probe,
+                'hold_seconds': args.hold,
+                'python': platform.python_version(),
+            },
+            'capacity': run_capacity(args.url, ids, steps, args.capacity_path, args.probe,
+                                     args.hold, args.timeout, args.seed),
+        }
+        print('%8s %8s %8s %8s %10s %10s %8s' % ('streams', 'open', 'refused', 'timeout',
+                                                 'probe p50', 'probe p95', 'errors'))
+        for step in result['capacity']:
+            print('%8d %8d %8d %8d %10s %10s %8d' % (
+                step['connections'], step['established'], step['rejected'], step['timed_out'],
+                step['probe_p50_ms'], step['probe_p95_ms'], step['probe_errors']))
+        if args.output:
+            with open(args.output, 'w') as fh:
+                json.dump(result, fh, indent=2, sort_keys=True)
+        return 0
+
+    plan = build_requests(ids, endpoints, args.iterations, args.seed)
+
+    began = time.perf_counter()
+    if args.url:
+        raw, wall = run_http(args.url, plan, args.processes)
+    else:
+        warm = build_requests(ids, endpoints, 1, args.seed + 1)[:args.warmup]
+        raw = run_inprocess(app, warm + plan, len(warm))
+        wall = time.perf_counter() - began
+
+    result = {
+        'meta': {
+            'commit': _git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'mode': 'http' if args.url else 'inprocess',
+            'target': args.url or app.config['SQLALCHEMY_DATABASE_URI'],
+            'processes': args.processes if args.url else 1,
+            'iterations': args.iterations,
+            'python': platform.python_version(),
+            'wall_seconds': round(wall, 3),
+            'throughput_rps': round(len(plan) / wall, 2) if wall else None,
+        },
+        'endpoints': {name: summarise(samples) for name, samples in sorted(raw.items())},
+    }
+
+    print('%-24s %8s %8s %8s %8s %6s' % ('endpoint', 'p50 ms', 'p95 ms', 'p99 ms', 'sql/req', 'errors'))
+    for name, stats in result['endpoints'].items():
+        print('%-24s %8.2f %8.2f %8.2f %8s %6d' % (
+            name, stats['p50_ms'], stats['p95_ms'], stats['p99_ms'],
+            stats['queries_per_request'], stats['errors']))
+    print('%d requests in %.2fs (%.1f req/s)' % (len(plan), wall, result['meta']['throughput_rps'] or 0))
+
+    if args.startup:
+        result['startup'] = measure_startup(args.startup)
+        print('worker start-up: p50 %(import_p50_ms).1f ms, max %(import_max_ms).1f ms '
+              '(create_app %(create_app_p50_ms).1f ms)' % result['startup'])
+
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(result, fh, indent=2, sort_keys=True)
+    if args.compare:
+        compare(result, args.compare)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,247 @@
+"""Negotiated response compression for API payloads.
+
+Responses above COMPRESS_MIN_SIZE with a compressible content type are
+encoded with the best algorithm the client accepts: zstd (when
+`zstandard` is installed), brotli (when `brotli` is installed) or gzip.
+Passthrough responses (file downloads) and anything that is already
+compressed are sent as is, and so are streamed responses by default. Set
+COMPRESS_STREAMS to True to compress those of a compressible type, such as
+stream_json_array, chunk by chunk as they are sent.
+
+Bytes in/out, CPU time and skip reasons are counted and exported on
+/metrics when instrumentation is enabled, so the threshold and levels can
+be tuned from real traffic.
+"""
+import gzip
+import threading
+import time
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # optional
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional
+    zstandard = None
+
+# Only these types are worth compressing; images, archives, PDFs, office
+# documents and other uploads are already compressed.
+COMPRESSIBLE_TYPES = (
+    'application/json', 'application/javascript', 'application/xml',
+    'text/html', 'text/css', 'text/plain', 'text/xml', 'text/javascript',
+    'text/csv', 'image/svg+xml',
+)
+
+DEFAULT_LEVELS = {'gzip': 6, 'br': 4, 'zstd': 3}
+
+
+def _gzip(data, level):
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def _brotli(data, level):
+    return brotli.compress(data, quality=level)
+
+
+def _zstd(data, level):
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+
+class _GzipStream(object):
+    def __init__(self, level):
+        self._obj = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, chunk):
+        return self._obj.compress(chunk) + self._obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._obj.flush()
+
+
+class _BrotliStream(object):
+    def __init__(self, level):
+        self._obj = brotli.Compressor(quality=level)
+
+    def compress(self, chunk):
+        return self._obj.process(chunk) + self._obj.flush()
+
+    def finish(self):
+        return self._obj.finish()
+
+
+class _ZstdStream(object):
+    def __init__(self, level):
+        self._obj = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, chunk):
+        return self._obj.compress(chunk) + self._obj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self._obj.flush()
+
+
+STREAM_ENCODERS = {'gzip': _GzipStream, 'br': _BrotliStream, 'zstd': _ZstdStream}
+
+
+def _by_label(values):
+    return lambda: {(k,): v for k, v in list(values.items())}
+
+
+def available_encoders():
+    """Encoders usable in this environment, in order of server preference."""
+    encoders = []
+    if zstandard is not None:
+        encoders.append(('zstd', _zstd))
+    if brotli is not None:
+        encoders.append(('br', _brotli))
+    encoders.append(('gzip', _gzip))
+    return encoders
+
+
+class Compression(object):
+    """Flask extension compressing responses in after_request.
+
+    Config keys (all optional):
+        COMPRESS_ENABLED     turn compression on/off (default True)
+        COMPRESS_MIN_SIZE    smallest body in bytes worth compressing (1024)
+        COMPRESS_LEVELS      {'gzip': 6, 'br': 4, 'zstd': 3}
+        COMPRESS_ALGORITHMS  allowed encodings in preference order
+        COMPRESS_MIMETYPES   content types that may be compressed
+        COMPRESS_STREAMS     compress streamed responses incrementally (False)
+    """
+
+    def __init__(self, app=None):
+        self.bytes_in = {}
+        self.bytes_out = {}
+        self.cpu_seconds = {}
+        self.responses = {}
+        self.skipped = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('COMPRESS_ENABLED', True)
+        app.config.setdefault('COMPRESS_MIN_SIZE', 1024)
+        app.config.setdefault('COMPRESS_LEVELS', dict(DEFAULT_LEVELS))
+        app.config.setdefault('COMPRESS_ALGORITHMS', [name for name, _ in available_encoders()])
+        app.config.setdefault('COMPRESS_MIMETYPES', COMPRESSIBLE_TYPES)
+        app.config.setdefault('COMPRESS_STREAMS', False)
+        encoders = dict(available_encoders())
+        self.encoders = [(name, encoders[name]) for name in app.config['COMPRESS_ALGORITHMS']
+                         if name in encoders]
+        self.levels = dict(DEFAULT_LEVELS, **app.config['COMPRESS_LEVELS'])
+        self.min_size = app.config['COMPRESS_MIN_SIZE']
+        self.mimetypes = frozenset(app.config['COMPRESS_MIMETYPES'])
+        self.enabled = app.config['COMPRESS_ENABLED']
+        self.streams = app.config['COMPRESS_STREAMS']
+        app.extensions['compression'] = self
+        app.after_request(self._after_request)
+
+        instrumentation = app.extensions.get('instrumentation')
+        if instrumentation is not None:
+            registry = instrumentation.registry
+            registry.gauge('lms_compression_bytes_in_total', 'Response bytes before compression.',
+                           ('encoding',), _by_label(self.bytes_in), 'counter')
+            registry.gauge('lms_compression_bytes_out_total', 'Response bytes after compression.',
+                           ('encoding',), _by_label(self.bytes_out), 'counter')
+            registry.gauge('lms_compression_cpu_seconds_total', 'CPU time spent compressing.',
+                           ('encoding',), _by_label(self.cpu_seconds), 'counter')
+            registry.gauge('lms_compression_responses_total', 'Responses compressed.',
+                           ('encoding',), _by_label(self.responses), 'counter')
+            registry.gauge('lms_compression_skipped_total', 'Responses sent uncompressed, by reason.',
+                           ('reason',), _by_label(self.skipped), 'counter')
+
+    def _count(self, table, key, amount=1):
+        with self._lock:
+            table[key] = table.get(key, 0) + amount
+
+    def _skip_reason(self, response):
+        if response.status_code < 200 or response.status_code in (204, 206, 304):
+            return 'status'
+        if response.direct_passthrough:
+            return 'passthrough'
+        if response.is_streamed and not self.streams:
+            return 'streamed'
+        if 'Content-Encoding' in response.headers:
+            return 'encoded'
+        if response.mimetype not in self.mimetypes:
+            return 'mimetype'
+        if response.content_length is not None and response.content_length < self.min_size:
+            return 'small'
+        return None
+
+    def _after_request(self, response):
+        if not self.enabled or not self.encoders:
+            return response
+        response.vary.add('Accept-Encoding')
+        reason = self._skip_reason(response)
+        if reason is None:
+            encoding = request.accept_encodings.best_match([name for name, _ in self.encoders])
+            if encoding is None or request.accept_encodings[encoding] == 0:
+                reason = 'not_accepted'
+        if reason is not None:
+            self._count(self.skipped, reason)
+            return response
+
+        if response.is_streamed:
+            return self._compress_stream(response, encoding)
+
+        data = response.get_data()
+        if len(data) < self.min_size:
+            self._count(self.skipped, 'small')
+            return response
+        compress = dict(self.encoders)[encoding]
+        started = time.thread_time()
+        compressed = compress(data, self.levels[encoding])
+        self._count(self.cpu_seconds, encoding, time.thread_time() - started)
+        if len(compressed) >= len(data):
+            self._count(self.skipped, 'incompressible')
+            return response
+
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        response.headers['Content-Length'] = str(len(compressed))
+        if response.headers.get('ETag'):
+            # The entity changed, so a strong validator from the raw body no longer holds.
+            response.set_etag(response.get_etag()[0], weak=True)
+        self._count(self.bytes_in, encoding, len(data))
+        self._count(self.bytes_out, encoding, len(compressed))
+        self._count(self.responses, encoding)
+        return response
+
+    def _compress_stream(self, response, encoding):
+        body = response.response
+        encoder = STREAM_ENCODERS[encoding](self.levels[encoding])
+        count = self._count
+
+        def generate():
+            try:
+                for chunk in body:
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode(response.charset)
+                    if not chunk:
+                        continue
+                    started = time.thread_time()
+                    out = encoder.compress(chunk)
+                    count(self.cpu_seconds, encoding, time.thread_time() - started)
+                    count(self.bytes_in, encoding, len(chunk))
+                    count(self.bytes_out, encoding, len(out))
+                    yield out
+                out = encoder.finish()
+                count(self.bytes_out, encoding, len(out))
+                yield out
+            finally:
+                if hasattr(body, 'close'):
+                    body.close()
+
+        response.response = generate()
+        response.headers['Content-Encoding'] = encoding
+        response.headers.pop('Content-Length', None)
+        self._count(self.responses, encoding)
+        return response
@@ -0,0 +1,215 @@
+"""Synthetic data generator for load tests and benchmarks.
+
+Builds a deterministic (seeded) dataset at realistic volumes: users,
+courses, enrollments, assignments, submissions, attendance, discussion
+posts, materials and notifications. Rows are written with bulk inserts in
+chunks so the large presets finish in reasonable time.
+
+    python datagen.py --scale medium --database sqlite:///bench.db
+    python datagen.py --users 5000 --courses 300 --submissions 250000
+"""
+import argparse
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from werkzeug.security import generate_password_hash
+
+from app import (Assignment, Attendance, Course, DiscussionPost, Enrollment, Material,
+                 Notification, Submission, User, create_app, db)
+
+SCALES = {
+    'small': dict(users=200, courses=20, assignments_per_course=5, enrollments_per_student=3,
+                  submissions=2000, attendance_days=10, posts_per_course=10,
+                  materials_per_course=3, notifications_per_user=20),
+    'medium': dict(users=2000, courses=200, assignments_per_course=10, enrollments_per_student=4,
+                   submissions=50000, attendance_days=30, posts_per_course=50,
+                   materials_per_course=5, notifications_per_user=50),
+    'large': dict(users=10000, courses=500, assignments_per_course=20, enrollments_per_student=5,
+                  submissions=300000, attendance_days=30, posts_per_course=200,
+                  materials_per_course=10, notifications_per_user=100),
+}
+
+TEACHER_RATIO = 0.05
+CHUNK = 5000
+PASSWORD = 'password'
+
+WORDS = ('python data web systems design intro advanced applied theory lab '
+         'networks security cloud mobile statistics algebra history writing '
+         'physics chemistry biology economics ethics databases graphics').split()
+
+
+def _text(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def _insert(model, rows):
+    table = model.__table__
+    for i in range(0, len(rows), CHUNK):
+        db.session.execute(table.insert(), rows[i:i + CHUNK])
+    db.session.commit()
+
+
+def _flush(model, rows, counts, key, force=False):
+    # Keeps memory flat for the tables that reach millions of rows
+    if rows and (force or len(rows) >= CHUNK * 4):
+        _insert(model, rows)
+        counts[key] = counts.get(key, 0) + len(rows)
+        del rows[:]
+
+
+def _ids(model, **filters):
+    query = db.session.query(model.id)
+    if filters:
+        query = query.filter_by(**filters)
+    return [row[0] for row in query.order_by(model.id)]
+
+
+def db_rows(*columns):
+    return db.session.query(*columns).all()
+
+
+def generate(users, courses, assignments_per_course, enrollments_per_student, submissions,
+             attendance_days, posts_per_course, materials_per_course, notifications_per_user,
+             seed=42, log=print):
+    """Populate the current app's database. Must run inside an app context."""
+
+    rng = random.Random(seed)
+    now = datetime.utcnow().replace(microsecond=0)
+    start = now - timedelta(days=120)
+    counts = {}
+
+    def stamp(days=120):
+        return start + timedelta(seconds=rng.randint(0, days * 86400))
+
+    # One hash for everyone: hashing per user would dominate generation time.
+    hashed = generate_password_hash(PASSWORD)
+    first_user = max(_ids(User) or [0]) + 1
+    n_teachers = max(1, int(users * TEACHER_RATIO))
+    rows = []
+    for i in range(users):
+        role = 'teacher' if i < n_teachers else 'student'
+        uid = first_user + i
+        rows.append({'name': '%s %d' % (role.capitalize(), uid), 'email': 'bench%d@example.com' % uid,
+                     'password': hashed, 'role': role, 'created_at': stamp()})
+    _insert(User, rows)
+    teacher_ids = _ids(User, role='teacher')
+    student_ids = _ids(User, role='student')
+    counts['users'] = users
+    log('users: %d (%d teachers)' % (users, n_teachers))
+
+    _insert(Course, [{'title': _text(rng, 3), 'description': _text(rng, 20),
+                      'duration': '%d weeks' % rng.randint(4, 12),
+                      'teacher_id': rng.choice(teacher_ids), 'created_at': stamp()}
+                     for _ in range(courses)])
+    course_ids = _ids(Course)
+    course_teacher = dict(db_rows(Course.id, Course.teacher_id))
+    counts['courses'] = courses
+    log('courses: %d' % courses)
+
+    roster = {cid: [] for cid in course_ids}
+    rows = []
+    for sid in student_ids:
+        for cid in rng.sample(course_ids, min(len(course_ids), enrollments_per_student)):
+            roster[cid].append(sid)
+            rows.append({'student_id': sid, 'course_id': cid, 'enrolled_at': stamp()})
+    _insert(Enrollment, rows)
+    counts['enrollments'] = len(rows)
+    log('enrollments: %d' % len(rows))
+
+    rows = []
+    for cid in course_ids:
+        for _ in range(assignments_per_course):
+            rows.append({'title': _text(rng, 4), 'description': _text(rng, 30),
+                         'due_date': stamp(150), 'course_id': cid, 'created_at': stamp()})
+    _insert(Assignment, rows)
+    assignments = {}
+    for aid, cid in db_rows(Assignment.id, Assignment.course_id):
+        assignments.setdefault(cid, []).append(aid)
+    counts['assignments'] = len(rows)
+    log('assignments: %d' % len(rows))
+
+    # Unique (student, assignment) pairs drawn from real enrollments
+    pairs = [(sid, aid) for cid, sids in roster.items() for sid in sids for aid in assignments.get(cid, ())]
+    rng.shuffle(pairs)
+    rows = []
+    for sid, aid in pairs[:submissions]:
+        graded = rng.random() < 0.6
+        rows.append({'content': _text(rng, rng.randint(20, 200)), 'student_id': sid, 'assignment_id': aid,
+                     'submitted_at': stamp(), 'grade': round(rng.uniform(40, 100), 1) if graded else None,
+                     'feedback': _text(rng, 8) if graded else None})
+    _insert(Submission, rows)
+    counts['submissions'] = len(rows)
+    log('submissions: %d' % len(rows))
+
+    rows = []
+    for cid, sids in roster.items():
+        for day in range(attendance_days):
+            date = (start + timedelta(days=day * 2)).date()
+            for sid in sids:
+                rows.append({'student_id': sid, 'course_id': cid, 'date': date,
+                             'present': rng.random() < 0.85, 'marked_at': stamp()})
+            _flush(Attendance, rows, counts, 'attendance')
+    _flush(Attendance, rows, counts, 'attendance', force=True)
+    log('attendance: %d' % counts.get('attendance', 0))
+
+    rows = []
+    for cid, sids in roster.items():
+        members = sids + [course_teacher[cid]]
+        for _ in range(posts_per_course):
+            rows.append({'course_id': cid, 'user_id': rng.choice(members),
+                         'content': _text(rng, rng.randint(5, 60)), 'created_at': stamp()})
+    _insert(DiscussionPost, rows)
+    counts['discussion_posts'] = len(rows)
+    log('discussion posts: %d' % len(rows))
+
+    rows = []
+    for cid in course_ids:
+        for n in range(materials_per_course):
+            filename = 'lecture_%d.pdf' % (n + 1)
+            rows.append({'course_id': cid, 'uploader_id': course_teacher[cid], 'filename': filename,
+                         'url': '/uploads/materials/course_%d/%s' % (cid, filename), 'uploaded_at': stamp()})
+    _insert(Material, rows)
+    counts['materials'] = len(rows)
+    log('materials: %d' % len(rows))
+
+    rows = []
+    titles = ('New Assignment', 'New Material', 'New Discussion Post', 'Assignment Graded')
+    for uid in teacher_ids + student_ids:
+        for _ in range(rng.randint(notifications_per_user // 2, notifications_per_user)):
+            rows.append({'user_id': uid, 'title': rng.choice(titles), 'message': _text(rng, 12),
+                         'created_at': stamp(), 'read': rng.random() < 0.7})
+        _flush(Notification, rows, counts, 'notifications')
+    _flush(Notification, rows, counts, 'notifications', force=True)
+    log('notifications: %d' % counts.get('notifications', 0))
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate synthetic LMS data.')
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    parser.add_argument('--database', help='SQLAlchemy URL (defaults to DATABASE_URL / sqlite:///lms.db)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--reset', action='store_true', help='drop and recreate all tables first')
+    for key in SCALES['small']:
+        parser.add_argument('--' + key.replace('_', '-'), type=int, dest=key,
+                            help='override the preset value (%s)' % key)
+    args = parser.parse_args(argv)
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': args.database} if args.database else None)
+
+    params = dict(SCALES[args.scale])
+    params.update({k: v for k, v in vars(args).items() if k in params and v is not None})
+    with app.app_context():
+        if args.reset:
+            db.drop_all()
+        db.create_all()
+        began = time.time()
+        counts = generate(seed=args.seed, **params)
+        print('done in %.1fs: %s' % (time.time() - began, counts))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
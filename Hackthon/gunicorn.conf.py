@@ -0,0 +1,39 @@
+"""Gunicorn settings for a preforked, multi-worker deployment.
+
+Every value can be overridden from the environment, e.g.
+`WEB_CONCURRENCY=8 gunicorn -c gunicorn.conf.py wsgi:app`.
+"""
+import multiprocessing
+import os
+
+bind = os.getenv('BIND', '0.0.0.0:%s' % os.getenv('PORT', '5000'))
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = os.getenv('WORKER_CLASS', 'gthread')
+threads = int(os.getenv('WORKER_THREADS', '4'))
+
+# Import the app once in the master; forked workers share its memory
+# copy-on-write instead of each re-importing and re-building it.
+preload_app = True
+
+# Recycle workers now and then to cap memory growth, staggered so they
+# don't all restart at once.
+max_requests = int(os.getenv('MAX_REQUESTS', '2000'))
+max_requests_jitter = int(os.getenv('MAX_REQUESTS_JITTER', '200'))
+
+timeout = int(os.getenv('WORKER_TIMEOUT', '60'))
+graceful_timeout = 30
+keepalive = 5
+# Keep worker heartbeat files off disk-backed /tmp where it is slow.
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+accesslog = os.getenv('ACCESS_LOG', '-')
+
+
+def post_fork(server, worker):
+    # Connections opened in the master must not be shared with children.
+    from app import db
+    from wsgi import app
+    with app.app_context():
+        db.engine.dispose()
+    server.log.info('worker %s ready (create_app took %.1f ms in master)',
+                    worker.pid, app.config['STARTUP_SECONDS'] * 1000.0)
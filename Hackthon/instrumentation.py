@@ -0,0 +1,415 @@
+"""Request profiling and SQL instrumentation for the LMS API.
+
+Records per-route latency and SQL statement count/time (through SQLAlchemy
+engine events), logs slow queries with their parameters redacted, warns
+when one statement shape repeats often enough within a request to look
+like an N+1 pattern, and serves everything on /metrics in the Prometheus
+text format. /metrics answers only loopback clients and those in
+INSTRUMENT_METRICS_ALLOW, or a request carrying INSTRUMENT_METRICS_TOKEN as
+a bearer token.
+
+A single request can be profiled by sending `X-Profile: cprofile` (or
+`pyinstrument` when that package is installed) while INSTRUMENT_PROFILING
+is on; the report is written to INSTRUMENT_PROFILE_DIR.
+"""
+import hmac
+import ipaddress
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter as _Counter
+
+from flask import Response, abort, current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger('lms.instrumentation')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250, 500)
+
+
+def _label_str(names, values):
+    if not names:
+        return ''
+    parts = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        parts.append('%s="%s"' % (name, value))
+    return '{%s}' % ','.join(parts)
+
+
+def _fmt(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter(object):
+    kind = 'counter'
+
+    def __init__(self, name, doc, labels=()):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for label_values, value in items:
+            yield self.name, _label_str(self.labels, label_values), value
+
+
+class Histogram(object):
+    kind = 'histogram'
+
+    def __init__(self, name, doc, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, amount, *label_values):
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                state = self._values[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if amount <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += amount
+            state[2] += 1
+
+    def total(self):
+        """(sum, count) over all label values."""
+        with self._lock:
+            return sum(v[1] for v in self._values.values()), sum(v[2] for v in self._values.values())
+
+    def samples(self):
+        with self._lock:
+            items = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self._values.items())
+        names = self.labels + ('le',)
+        for label_values, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                yield self.name + '_bucket', _label_str(names, label_values + (_fmt(bound),)), cumulative
+            yield self.name + '_sum', _label_str(self.labels, label_values), total
+            yield self.name + '_count', _label_str(self.labels, label_values), count
+
+
+class Gauge(object):
+    """Value read from a callback at scrape time: fn() -> {label_values: value}."""
+
+    def __init__(self, name, doc, labels, fn, kind='gauge'):
+        self.kind = kind
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self.fn = fn
+
+    def samples(self):
+        for label_values, value in sorted(self.fn().items()):
+            yield self.name, _label_str(self.labels, label_values), value
+
+
+class Registry(object):
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, doc, labels=()):
+        return self.register(Counter(name, doc, labels))
+
+    def histogram(self, name, doc, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, doc, labels, buckets))
+
+    def gauge(self, name, doc, labels, fn, kind='gauge'):
+        return self.register(Gauge(name, doc, labels, fn, kind))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append('# HELP %s %s' % (metric.name, metric.doc))
+            lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+            for name, labels, value in metric.samples():
+                lines.append('%s%s %s' % (name, labels, _fmt(value)))
+        return '\n'.join(lines) + '\n'
+
+
+_WS_RE = re.compile(r'\s+')
+_IN_LIST_RE = re.compile(r'\(\s*(\?|%\(\w+\)s|:\w+)(\s*,\s*(\?|%\(\w+\)s|:\w+))*\s*\)')
+_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+def statement_shape(statement):
+    """Normalise SQL so queries differing only in values compare equal."""
+    shape = _WS_RE.sub(' ', statement).strip()
+    shape = _LITERAL_RE.sub('?', shape)
+    shape = _IN_LIST_RE.sub('(?)', shape)
+    return shape
+
+
+def redact_params(params):
+    """Describe bound parameters by type only, never by value."""
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {k: type(v).__name__ for k, v in params.items()}
+    if isinstance(params, (list, tuple)):
+        if params and isinstance(params[0], (list, tuple, dict)):
+            return '<%d parameter sets>' % len(params)
+        return [type(v).__name__ for v in params]
+    return type(params).__name__
+
+
+class RequestStats(object):
+    __slots__ = ('start', 'query_count', 'query_time', 'shapes', 'warned', 'profiler', 'profile_path')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.query_count = 0
+        self.query_time = 0.0
+        self.shapes = _Counter()
+        self.warned = set()
+        self.profiler = None
+        self.profile_path = None
+
+
+def _forward(name):
+    def listener(conn, cursor, statement, parameters, context, executemany):
+        if not has_request_context():
+            return
+        ext = current_app.extensions.get('instrumentation')
+        if ext is not None:
+            getattr(ext, name)(conn, cursor, statement, parameters, context, executemany)
+    return listener
+
+
+_events_installed = False
+
+
+def _install_engine_events():
+    # Listening on the Engine class covers every engine Flask-SQLAlchemy
+    # creates; events go to whichever app is handling the request.
+    global _events_installed
+    if _events_installed:
+        return
+    event.listen(Engine, 'before_cursor_execute', _forward('_before_cursor_execute'))
+    event.listen(Engine, 'after_cursor_execute', _forward('_after_cursor_execute'))
+    _events_installed = True
+
+
+class Instrumentation(object):
+    """Flask extension collecting per-request timing and SQL metrics.
+
+    Config keys (all optional):
+        INSTRUMENT_ENABLED                turn collection on/off (default True)
+        INSTRUMENT_SLOW_QUERY_MS          log statements slower than this (200)
+        INSTRUMENT_N_PLUS_ONE_THRESHOLD   repeats of one shape that warn (10)
+        INSTRUMENT_METRICS_PATH           where metrics are served (/metrics)
+        INSTRUMENT_METRICS_TOKEN          bearer token that may read metrics (none)
+        INSTRUMENT_METRICS_ALLOW          client addresses/networks that may read
+                                          them without a token (loopback only)
+        INSTRUMENT_PROFILING              honour X-Profile (default app.debug)
+        INSTRUMENT_PROFILE_DIR            where profile reports are written
+    """
+
+    def __init__(self, app=None):
+        self.registry = Registry()
+        self.request_latency = self.registry.histogram(
+            'lms_request_duration_seconds', 'Request latency by route.',
+            ('method', 'route', 'status'))
+        self.request_queries = self.registry.histogram(
+            'lms_request_sql_statements', 'SQL statements executed per request.',
+            ('method', 'route'), QUERY_COUNT_BUCKETS)
+        self.request_query_time = self.registry.histogram(
+            'lms_request_sql_seconds', 'Time spent in SQL per request.',
+            ('method', 'route'))
+        self.slow_queries = self.registry.counter(
+            'lms_slow_queries_total', 'Statements slower than INSTRUMENT_SLOW_QUERY_MS.', ('route',))
+        self.n_plus_one = self.registry.counter(
+            'lms_n_plus_one_warnings_total', 'Requests repeating one statement shape too often.', ('route',))
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('INSTRUMENT_ENABLED', True)
+        app.config.setdefault('INSTRUMENT_SLOW_QUERY_MS', 200)
+        app.config.setdefault('INSTRUMENT_N_PLUS_ONE_THRESHOLD', 10)
+        app.config.setdefault('INSTRUMENT_METRICS_PATH', '/metrics')
+        app.config.setdefault('INSTRUMENT_METRICS_TOKEN', None)
+        app.config.setdefault('INSTRUMENT_METRICS_ALLOW', ('127.0.0.1/8', '::1'))
+        app.config.setdefault('INSTRUMENT_PROFILING', app.debug)
+        app.config.setdefault('INSTRUMENT_PROFILE_DIR', os.path.join(app.instance_path, 'profiles'))
+        app.extensions['instrumentation'] = self
+
+        limiter = app.extensions.get('ratelimit')
+        if limiter is not None:
+            self.registry.gauge(
+                'lms_ratelimit_shed_total', 'Requests shed under load by priority class.',
+                ('priority',), lambda: {(k,): v for k, v in limiter.shed_count.items()}, 'counter')
+            self.registry.gauge(
+                'lms_ratelimit_limited_total', 'Requests rejected by token buckets.',
+                (), lambda: {(): limiter.limited_count}, 'counter')
+            self.registry.gauge(
+                'lms_queue_latency_seconds', 'Estimated request queue latency.',
+                (), lambda: {(): limiter.monitor.latency})
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.add_url_rule(app.config['INSTRUMENT_METRICS_PATH'], 'metrics', self.metrics_view)
+        _install_engine_events()
+
+    def metrics_view(self):
+        if not self._metrics_allowed(current_app.config):
+            abort(403)
+        return Response(self.registry.render(), mimetype='text/plain; version=0.0.4')
+
+    @staticmethod
+    def _metrics_allowed(config):
+        token = config['INSTRUMENT_METRICS_TOKEN']
+        if token:
+            auth = request.headers.get('Authorization', '')
+            if auth.startswith('Bearer ') and hmac.compare_digest(auth[7:].encode(), token.encode()):
+                return True
+        # The socket peer, never X-Forwarded-For: behind a local proxy this is the
+        # proxy itself, so block the path there or rely on the token.
+        try:
+            client = ipaddress.ip_address(request.remote_addr or '')
+        except ValueError:
+            return False
+        return any(client in ipaddress.ip_network(net, strict=False)
+                   for net in config['INSTRUMENT_METRICS_ALLOW'])
+
+    @staticmethod
+    def _stats():
+        if not has_request_context():
+            return None
+        return g.get('_lms_stats')
+
+    def _route(self):
+        return request.url_rule.rule if request.url_rule is not None else '<unmatched>'
+
+    def _before_request(self):
+        if not current_app.config['INSTRUMENT_ENABLED']:
+            return
+        stats = g._lms_stats = RequestStats()
+        mode = request.headers.get('X-Profile', '').lower()
+        if mode and current_app.config['INSTRUMENT_PROFILING']:
+            stats.profiler = self._start_profiler(mode)
+
+    def _after_request(self, response):
+        stats = self._stats()
+        if stats is None:
+            return response
+        route = self._route()
+        if response.is_streamed:
+            # The body (and its queries) runs after this; record once it is sent.
+            method, status = request.method, str(response.status_code)
+            out_dir = current_app.config['INSTRUMENT_PROFILE_DIR']
+            response.call_on_close(lambda: self._record(stats, method, route, status, out_dir))
+            return response
+        elapsed = self._record(stats, request.method, route, str(response.status_code),
+                               current_app.config['INSTRUMENT_PROFILE_DIR'])
+        response.headers['X-SQL-Count'] = str(stats.query_count)
+        response.headers['Server-Timing'] = 'app;dur=%.1f, db;dur=%.1f' % (
+            elapsed * 1000.0, stats.query_time * 1000.0)
+        if stats.profile_path:
+            response.headers['X-Profile-Output'] = stats.profile_path
+        return response
+
+    def _record(self, stats, method, route, status, out_dir):
+        elapsed = time.perf_counter() - stats.start
+        self.request_latency.observe(elapsed, method, route, status)
+        self.request_queries.observe(stats.query_count, method, route)
+        self.request_query_time.observe(stats.query_time, method, route)
+        if stats.profiler is not None:
+            stats.profile_path = self._stop_profiler(stats.profiler, method, route, out_dir)
+            stats.profiler = None
+        return elapsed
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        stats = self._stats()
+        if stats is None:
+            return
+        conn.info.setdefault('lms_query_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        stats = self._stats()
+        if stats is None:
+            return
+        starts = conn.info.get('lms_query_start')
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        stats.query_count += 1
+        stats.query_time += elapsed
+
+        route = self._route()
+        slow_ms = current_app.config['INSTRUMENT_SLOW_QUERY_MS']
+        threshold = current_app.config['INSTRUMENT_N_PLUS_ONE_THRESHOLD']
+        if slow_ms is not None and elapsed * 1000.0 >= slow_ms:
+            self.slow_queries.inc(1, route)
+            logger.warning('slow query %.1fms on %s %s: %s params=%s',
+                           elapsed * 1000.0, request.method, route,
+                           _WS_RE.sub(' ', statement).strip(), redact_params(parameters))
+
+        shape = statement_shape(statement)
+        stats.shapes[shape] += 1
+        if threshold and stats.shapes[shape] > threshold and shape not in stats.warned:
+            stats.warned.add(shape)
+            self.n_plus_one.inc(1, route)
+            logger.warning('possible N+1 on %s %s: statement repeated more than %d times: %s',
+                           request.method, route, threshold, shape)
+
+    def _start_profiler(self, mode):
+        if mode == 'pyinstrument':
+            try:
+                from pyinstrument import Profiler
+            except ImportError:
+                logger.warning('X-Profile: pyinstrument requested but not installed, using cProfile')
+            else:
+                profiler = Profiler()
+                profiler.start()
+                return ('pyinstrument', profiler)
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return ('cprofile', profiler)
+
+    def _stop_profiler(self, handle, method, route, out_dir):
+        kind, profiler = handle
+        os.makedirs(out_dir, exist_ok=True)
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_') or 'root'
+        base = os.path.join(out_dir, '%s_%s_%d' % (method.lower(), slug, int(time.time() * 1000)))
+        if kind == 'pyinstrument':
+            profiler.stop()
+            path = base + '.html'
+            with open(path, 'w') as fh:
+                fh.write(profiler.output_html())
+        else:
+            profiler.disable()
+            path = base + '.prof'
+            profiler.dump_stats(path)
+        logger.info('profile for %s %s written to %s', method, route, path)
+        return path
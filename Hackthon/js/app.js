@@ -1,6 +1,62 @@
 // Global variables
 let currentUser = null;
 const API_URL = 'http://localhost:5000/api';
+const BATCH_LIMIT = 20; // keep in sync with BATCH_MAX_REQUESTS on the server
+const PREFETCH_TTL_MS = 5000;
+
+// GET several API paths (relative to API_URL) in one /api/batch round trip.
+// Resolves to the response bodies in the same order, like fetch(...).json()
+// would; falls back to individual requests if the batch call itself fails.
+const batchGet = async (paths) => {
+    const results = [];
+    for (let i = 0; i < paths.length; i += BATCH_LIMIT) {
+        const chunk = paths.slice(i, i + BATCH_LIMIT);
+        try {
+            const res = await fetch(`${API_URL}/batch`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ requests: chunk.map(p => ({ path: `/api${p}` })) })
+            });
+            if (!res.ok) throw new Error(`batch failed: ${res.status}`);
+            const data = await res.json();
+            results.push(...data.responses.map(r => r.body));
+        } catch (_) {
+            results.push(...await Promise.all(chunk.map(p => fetch(`${API_URL}${p}`).then(r => r.json()))));
+        }
+    }
+    return results;
+};
+
+// Results of a batched prefetch, consumed by getJSON. Each listed path may be
+// read as many times as it was listed, so several loaders can share one fetch.
+const prefetched = new Map();
+const prefetch = (paths) => {
+    const unique = [...new Set(paths)];
+    const pending = batchGet(unique);
+    const expires = Date.now() + PREFETCH_TTL_MS;
+    unique.forEach((p, i) => {
+        prefetched.set(p, {
+            promise: pending.then(bodies => bodies[i]),
+            remaining: paths.filter(q => q === p).length,
+            expires
+        });
+    });
+};
+const getJSON = async (path) => {
+    const entry = prefetched.get(path);
+    if (entry) {
+        if (--entry.remaining <= 0) prefetched.delete(path);
+        if (entry.expires > Date.now()) {
+            try {
+                return await entry.promise;
+            } catch (_) {
+                // fall through to a normal request
+            }
+        }
+    }
+    const res = await fetch(`${API_URL}${path}`);
+    return res.json();
+};
 
 // DOM Elements
 document.addEventListener('DOMContentLoaded', () => {
@@ -92,8 +148,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const loadStudentAttendance = async () => {
         if (!currentUser || currentUser.role !== 'student') return;
         try {
-            const res = await fetch(`${API_URL}/attendance/student/${currentUser.id}`);
-            const summaries = await res.json();
+            const summaries = await getJSON(`/attendance/student/${currentUser.id}`);
             const container = document.getElementById('studentAttendance');
             if (!container) return;
             container.innerHTML = '';
@@ -125,8 +180,7 @@ document.addEventListener('DOMContentLoaded', () => {
         if (!attendanceCourseSelect || !attendanceList) return;
         try {
             // Load teacher courses
-            const resp = await fetch(`${API_URL}/courses`);
-            const all = await resp.json();
+            const all = await getJSON('/courses');
             const myCourses = all.filter(c => c.teacher_id === currentUser.id || c.teacher === currentUser.name);
             attendanceCourseSelect.innerHTML = '';
             if (myCourses.length === 0) {
@@ -300,11 +354,11 @@ document.addEventListener('DOMContentLoaded', () => {
         // Stats
         try {
             if (currentUser.role === 'student') {
-                const er = await fetch(`${API_URL}/my-courses/${currentUser.id}`);
-                const courses = await er.json();
+                const [courses, grades] = await batchGet([
+                    `/my-courses/${currentUser.id}`,
+                    `/grades/student/${currentUser.id}`
+                ]);
                 if (enrolledEl) enrolledEl.textContent = Array.isArray(courses) ? courses.length : 0;
-                const gr = await fetch(`${API_URL}/grades/student/${currentUser.id}`);
-                const grades = await gr.json();
                 const submissions = Array.isArray(grades) ? grades.flatMap(g => g.submissions || []) : [];
                 if (subsEl) subsEl.textContent = submissions.length;
                 const avgs = Array.isArray(grades) ? grades.map(g => g.average).filter(v => v != null) : [];
@@ -315,16 +369,10 @@ document.addEventListener('DOMContentLoaded', () => {
                 const cr = await fetch(`${API_URL}/courses`);
                 const all = await cr.json();
                 const mine = Array.isArray(all) ? all.filter(c => c.teacher_id === currentUser.id || c.teacher === currentUser.name) : [];
-                let totalSubs = 0;
-                for (const c of mine) {
-                    const ar = await fetch(`${API_URL}/course/${c.id}/assignments`);
-                    const assigns = await ar.json();
-                    for (const a of (assigns || [])) {
-                        const sr = await fetch(`${API_URL}/assignment/${a.id}/submissions?teacher_id=${currentUser.id}`);
-                        const subs = await sr.json();
-                        totalSubs += Array.isArray(subs) ? subs.length : 0;
-                    }
-                }
+                const assignLists = await batchGet(mine.map(c => `/course/${c.id}/assignments`));
+                const assigns = assignLists.flatMap(list => Array.isArray(list) ? list : []);
+                const subLists = await batchGet(assigns.map(a => `/assignment/${a.id}/submissions?teacher_id=${currentUser.id}`));
+                const totalSubs = subLists.reduce((n, subs) => n + (Array.isArray(subs) ? subs.length : 0), 0);
                 if (subsEl) subsEl.textContent = totalSubs;
                 if (avgEl) avgEl.textContent = '-';
             }
@@ -356,13 +404,24 @@ document.addEventListener('DOMContentLoaded', () => {
             if (currentUser.role === 'student') {
                 studentDashboard.style.display = 'grid';
                 teacherDashboard.style.display = 'none';
+                // One round trip for everything the dashboard loaders below need
+                prefetch([
+                    `/my-courses/${currentUser.id}`,
+                    `/student/${currentUser.id}/assignments`,
+                    `/attendance/student/${currentUser.id}`,
+                    `/notifications/${currentUser.id}`
+                ]);
                 loadEnrolledCourses();
                 loadStudentAssignments();
                 loadStudentAttendance();
-                loadStudentGrades();
+                if (typeof loadStudentGrades === 'function') {
+                    loadStudentGrades();
+                }
             } else if (currentUser.role === 'teacher') {
                 teacherDashboard.style.display = 'grid';
                 studentDashboard.style.display = 'none';
+                // /courses is read by all three loaders below
+                prefetch(['/courses', '/courses', '/courses', `/notifications/${currentUser.id}`]);
                 loadTeacherCourses();
                 loadTeacherAssignments();
                 initTeacherAttendanceUI();
@@ -483,8 +542,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const fetchNotifications = async () => {
         if (!currentUser) return [];
         try {
-            const res = await fetch(`${API_URL}/notifications/${currentUser.id}`);
-            const items = await res.json();
+            const items = await getJSON(`/notifications/${currentUser.id}`);
             return Array.isArray(items) ? items : [];
         } catch (_) {
             return [];
@@ -725,12 +783,18 @@ document.addEventListener('DOMContentLoaded', () => {
     // View course details
     const viewCourseDetails = async (courseId) => {
         try {
-            const response = await fetch(`${API_URL}/courses`);
-            const courses = await response.json();
-            
-            const course = courses.find(c => c.id === courseId);
+            // Fetch the course and its panels in one batch; the loaders below read from it
+            const completionPath = currentUser && currentUser.role === 'student'
+                ? `/course/${courseId}/completion?student_id=${currentUser.id}` : null;
+            prefetch([
+                `/course/${courseId}`,
+                `/course/${courseId}/materials`,
+                `/course/${courseId}/discussion`,
+                ...(completionPath ? [completionPath] : [])
+            ]);
+            const course = await getJSON(`/course/${courseId}`);
             
-            if (!course) {
+            if (!course || course.error) {
                 showMessage('Course not found');
                 return;
             }
@@ -787,8 +851,7 @@ document.addEventListener('DOMContentLoaded', () => {
             // Materials: load list and handle upload (teacher)
             const loadMaterials = async () => {
                 try {
-                    const r = await fetch(`${API_URL}/course/${courseId}/materials`);
-                    const items = await r.json();
+                    const items = await getJSON(`/course/${courseId}/materials`);
                     const list = document.getElementById('materialsList');
                     if (!list) return;
                     list.innerHTML = '';
@@ -832,8 +895,7 @@ document.addEventListener('DOMContentLoaded', () => {
             // Discussion: load list and handle post
             const loadDiscussion = async () => {
                 try {
-                    const r = await fetch(`${API_URL}/course/${courseId}/discussion`);
-                    const posts = await r.json();
+                    const posts = await getJSON(`/course/${courseId}/discussion`);
                     const list = document.getElementById('discussionList');
                     if (!list) return;
                     list.innerHTML = '';
@@ -879,8 +941,7 @@ document.addEventListener('DOMContentLoaded', () => {
             if (completeBtn && currentUser && currentUser.role === 'student') {
                 // Check completion status to set initial state
                 try {
-                    const cres = await fetch(`${API_URL}/course/${courseId}/completion?student_id=${currentUser.id}`);
-                    const cdata = await cres.json();
+                    const cdata = await getJSON(completionPath);
                     if (cdata && cdata.completed) {
                         completeBtn.textContent = 'Completed';
                         completeBtn.disabled = true;
@@ -1003,8 +1064,7 @@ document.addEventListener('DOMContentLoaded', () => {
         }
         
         try {
-            const response = await fetch(`${API_URL}/my-courses/${currentUser.id}`);
-            const courses = await response.json();
+            const courses = await getJSON(`/my-courses/${currentUser.id}`);
             
             const enrolledCourses = document.getElementById('enrolledCourses');
             enrolledCourses.innerHTML = '';
@@ -1084,8 +1144,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const loadStudentAssignments = async () => {
         if (!currentUser || currentUser.role !== 'student') return;
         try {
-            const resp = await fetch(`${API_URL}/student/${currentUser.id}/assignments`);
-            const assignments = await resp.json();
+            const assignments = await getJSON(`/student/${currentUser.id}/assignments`);
             const container = document.getElementById('studentAssignments');
             container.innerHTML = '';
             if (!Array.isArray(assignments) || assignments.length === 0) {
@@ -1175,8 +1234,7 @@ document.addEventListener('DOMContentLoaded', () => {
             return;
         }
         try {
-            const response = await fetch(`${API_URL}/courses`);
-            const allCourses = await response.json();
+            const allCourses = await getJSON('/courses');
             const teacherCourses = allCourses.filter(course => course.teacher_id === currentUser.id || course.teacher === currentUser.name);
             const teacherCoursesElement = document.getElementById('teacherCourses');
             teacherCoursesElement.innerHTML = '';
@@ -1243,8 +1301,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const loadTeacherAssignments = async () => {
         if (!currentUser || currentUser.role !== 'teacher') return;
         try {
-            const resp = await fetch(`${API_URL}/courses`);
-            const allCourses = await resp.json();
+            const allCourses = await getJSON('/courses');
             const teacherCourses = allCourses.filter(c => c.teacher_id === currentUser.id || c.teacher === currentUser.name);
             const container = document.getElementById('teacherAssignments');
             container.innerHTML = '';
@@ -1252,14 +1309,10 @@ document.addEventListener('DOMContentLoaded', () => {
                 container.innerHTML = '<p>You have not created any courses yet.</p>';
                 return;
             }
-            const results = await Promise.all(teacherCourses.map(async (c) => {
-                try {
-                    const r = await fetch(`${API_URL}/course/${c.id}/assignments`);
-                    const list = await r.json();
-                    return { course: c, assignments: Array.isArray(list) ? list : [] };
-                } catch (_) {
-                    return { course: c, assignments: [] };
-                }
+            const lists = await batchGet(teacherCourses.map(c => `/course/${c.id}/assignments`));
+            const results = teacherCourses.map((c, i) => ({
+                course: c,
+                assignments: Array.isArray(lists[i]) ? lists[i] : []
             }));
             let count = 0;
             results.forEach(({ course, assignments }) => {
@@ -0,0 +1,140 @@
+"""Fast JSON serialization for API responses.
+
+JSONProvider encodes with orjson when it is installed and with the
+standard library otherwise. Datetimes and dates are encoded natively as ISO
+8601, so views can pass model values straight through instead of calling
+.isoformat() per row, and output is always compact (no debug-mode pretty
+printing). Use this module's `jsonify` in place of Flask's.
+
+stream_json_array() emits a large list element by element, so the full
+document is never built in memory.
+
+The provider has the same dumps/loads/response interface as the JSON
+providers of Flask 2.2+, where it is also installed as `app.json`.
+"""
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from flask import current_app, stream_with_context
+from flask.json import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # optional speed-up
+    orjson = None
+
+STREAM_BATCH = 200
+
+
+def _default(o):
+    if isinstance(o, (datetime, date)):
+        return o.isoformat()
+    if isinstance(o, Decimal):
+        return float(o)
+    if hasattr(o, '__html__'):
+        return str(o.__html__())
+    raise TypeError('Object of type %s is not JSON serializable' % type(o).__name__)
+
+
+class LMSJSONEncoder(JSONEncoder):
+    """Stdlib encoder: ISO 8601 datetimes instead of Flask's HTTP-date format."""
+
+    def default(self, o):
+        if isinstance(o, (datetime, date)):
+            return o.isoformat()
+        return super().default(o)
+
+
+class JSONProvider(object):
+    """Config keys (all optional):
+        JSON_USE_ORJSON   use orjson when installed (default True)
+    """
+
+    def __init__(self, app=None):
+        self.use_orjson = False
+        self.mimetype = 'application/json'
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('JSON_USE_ORJSON', True)
+        app.config['JSONIFY_PRETTYPRINT_REGULAR'] = False
+        self.use_orjson = bool(app.config['JSON_USE_ORJSON'] and orjson is not None)
+        self.mimetype = app.config.get('JSONIFY_MIMETYPE', 'application/json')
+        app.json_encoder = LMSJSONEncoder
+        app.extensions['json_provider'] = self
+        if hasattr(app, 'json') and hasattr(app.json, 'response'):
+            app.json = self
+
+    def dumps_bytes(self, obj):
+        if self.use_orjson:
+            return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+        return json.dumps(obj, default=_default, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            kwargs.setdefault('default', _default)
+            return json.dumps(obj, **kwargs)
+        return self.dumps_bytes(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if self.use_orjson and not kwargs:
+            return orjson.loads(s)
+        if isinstance(s, bytes):
+            s = s.decode('utf-8')
+        return json.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        if args and kwargs:
+            raise TypeError('jsonify() behavior undefined when passed both args and kwargs')
+        if len(args) == 1:
+            data = args[0]
+        else:
+            data = args or kwargs
+        return current_app.response_class(self.dumps_bytes(data) + b'\n', mimetype=self.mimetype)
+
+    def stream_array(self, items, status=200):
+        dumps = self.dumps_bytes
+
+        def generate():
+            yield b'['
+            first = True
+            batch = []
+            for item in items:
+                batch.append(dumps(item))
+                if len(batch) >= STREAM_BATCH:
+                    yield (b',' if not first else b'') + b','.join(batch)
+                    first = False
+                    batch = []
+            if batch:
+                yield (b',' if not first else b'') + b','.join(batch)
+            yield b']\n'
+
+        return current_app.response_class(stream_with_context(generate()), status=status,
+                                          mimetype=self.mimetype)
+
+
+def _provider():
+    provider = current_app.extensions.get('json_provider')
+    if provider is None:
+        provider = current_app.extensions['json_provider'] = JSONProvider()
+    return provider
+
+
+def dumps(obj):
+    """Compact JSON text, encoded like API responses."""
+    return _provider().dumps(obj)
+
+
+def jsonify(*args, **kwargs):
+    return _provider().response(*args, **kwargs)
+
+
+def stream_json_array(items, status=200):
+    """Response that serialises `items` (any iterable of JSON-able values) lazily.
+
+    The iterable is consumed while the body is sent, inside the request
+    context, so it can be a generator over a query.
+    """
+    return _provider().stream_array(items, status)
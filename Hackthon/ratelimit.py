@@ -0,0 +1,409 @@
+"""Per-route rate limiting and load shedding for the LMS API.
+
+Each limited route gets a token bucket per user (taken from the login
+session) and/or per client IP; a request is only charged when every one of
+its buckets has a token. Busy routes are limited per user and fall back to
+a much larger per-IP bucket only without a session, because a whole campus
+behind NAT shares one address. Routes also carry a priority class; when the
+observed queue latency passes RATELIMIT_SHED_LATENCY, requests are shed
+with 429 + Retry-After, lowest priority first, so submissions keep being
+served while notification polling backs off.
+
+Buckets live in a pluggable backend: MemoryBackend for a single process,
+SharedBackend for state shared between worker processes (see
+SharedBackend.local() for a multiprocessing stand-in used in tests) and
+RedisBackend when `redis` is installed.
+"""
+import math
+import threading
+import time
+
+from flask import current_app, jsonify, request, session
+
+PRIORITIES = ('high', 'normal', 'low')
+
+# Keys are URL rules as written in app.py, so they survive endpoint renames.
+# 'per' lists the buckets to charge: 'user' falls back to the client IP when
+# there is no session. IP buckets use 'ip_rate'/'ip_burst' when given, sized
+# for many users sharing one address.
+DEFAULT_ROUTE_LIMITS = {
+    '/api/submit': {'rate': 0.5, 'burst': 5, 'ip_rate': 10.0, 'ip_burst': 200, 'priority': 'high',
+                    'per': ('user',)},
+    '/api/submit-file': {'rate': 0.2, 'burst': 3, 'ip_rate': 5.0, 'ip_burst': 100, 'priority': 'high',
+                         'per': ('user',)},
+    # No session yet, so only the IP can be limited
+    '/api/login': {'ip_rate': 5.0, 'ip_burst': 100, 'priority': 'high', 'per': ('ip',)},
+    '/api/notifications/<int:user_id>': {'rate': 0.5, 'burst': 10, 'ip_rate': 10.0, 'ip_burst': 200,
+                                         'priority': 'low', 'per': ('user',)},
+    '/api/notifications/mark-read': {'rate': 1.0, 'burst': 5, 'ip_rate': 20.0, 'ip_burst': 200,
+                                     'priority': 'low', 'per': ('user',)},
+    '/api/batch': {'rate': 2.0, 'burst': 10, 'ip_rate': 20.0, 'ip_burst': 200, 'priority': 'normal',
+                   'per': ('user',)},
+    # Limits reconnects; 'stream' keeps long-lived responses out of the latency estimate
+    '/api/notifications/<int:user_id>/stream': {'rate': 0.2, 'burst': 5, 'ip_rate': 5.0, 'ip_burst': 100,
+                                                'priority': 'low', 'per': ('user',), 'stream': True},
+}
+
+# Multiplier on RATELIMIT_SHED_LATENCY at which each class starts shedding.
+DEFAULT_SHED_FACTORS = {'high': 4.0, 'normal': 2.0, 'low': 1.0}
+
+# Endpoints never shed: the frontend itself and the metrics scrape.
+DEFAULT_SHED_EXEMPT = ('static', 'lms.index', 'lms.serve_static', 'metrics')
+
+
+def _take(state, rate, burst, cost, now):
+    """Refill a bucket and try to take `cost` tokens from it.
+
+    Returns (new_state, allowed, retry_after_seconds).
+    """
+    if state is None:
+        tokens, last = float(burst), now
+    else:
+        tokens, last = state
+        tokens = min(float(burst), tokens + max(0.0, now - last) * rate)
+    if tokens >= cost:
+        return (tokens - cost, now), True, 0.0
+    retry_after = (cost - tokens) / rate if rate > 0 else float('inf')
+    return (tokens, now), False, retry_after
+
+
+def _take_all(states, buckets, cost, now):
+    """_take over several buckets, all or nothing: tokens are only taken when
+    every bucket has them, so a refusal by one never spends another's.
+
+    `buckets` is [(key, rate, burst)]. Returns (new_states, allowed, retry_after).
+    """
+    results = [_take(state, rate, burst, cost, now) for state, (_, rate, burst) in zip(states, buckets)]
+    if all(allowed for _, allowed, _ in results):
+        return [state for state, _, _ in results], True, 0.0
+    return list(states), False, max(retry for _, allowed, retry in results if not allowed)
+
+
+class MemoryBackend(object):
+    """Token buckets held in this process only."""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def consume(self, key, rate, burst, cost=1, now=None):
+        return self.consume_all([(key, rate, burst)], cost, now)
+
+    def consume_all(self, buckets, cost=1, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            states, allowed, retry_after = _take_all(
+                [self._buckets.get(key) for key, _, _ in buckets], buckets, cost, now)
+            if allowed:
+                for (key, _, _), state in zip(buckets, states):
+                    self._buckets[key] = state
+        return allowed, retry_after
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class SharedBackend(object):
+    """Token buckets in a store shared between processes.
+
+    `store` needs dict-style get/item assignment/clear and `lock` must be a
+    context manager that serialises access across all sharing processes.
+    """
+
+    def __init__(self, store, lock):
+        self.store = store
+        self.lock = lock
+
+    @classmethod
+    def local(cls, manager=None):
+        """Stand-in for a shared store backed by a multiprocessing manager.
+
+        Pass the backend (it pickles as manager proxies) to worker processes
+        to exercise cross-process limits without an external service.
+        """
+        if manager is None:
+            import multiprocessing
+            manager = multiprocessing.Manager()
+        return cls(manager.dict(), manager.Lock())
+
+    def consume(self, key, rate, burst, cost=1, now=None):
+        return self.consume_all([(key, rate, burst)], cost, now)
+
+    def consume_all(self, buckets, cost=1, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            states, allowed, retry_after = _take_all(
+                [self.store.get(key) for key, _, _ in buckets], buckets, cost, now)
+            if allowed:
+                self.store.update({key: state for (key, _, _), state in zip(buckets, states)})
+        return allowed, retry_after
+
+    def reset(self):
+        with self.lock:
+            self.store.clear()
+
+
+class RedisBackend(object):
+    """Token buckets in Redis, refilled and taken atomically by a server-side script."""
+
+    # ARGV: cost, now, then rate and burst for each key
+    SCRIPT = """
+local cost, now = tonumber(ARGV[1]), tonumber(ARGV[2])
+local tokens = {}
+local denied, retry = false, 0
+for i, key in ipairs(KEYS) do
+  local rate, burst = tonumber(ARGV[2 * i + 1]), tonumber(ARGV[2 * i + 2])
+  local state = redis.call('HMGET', key, 'tokens', 'ts')
+  local available, ts = tonumber(state[1]), tonumber(state[2])
+  if available == nil then available, ts = burst, now end
+  available = math.min(burst, available + math.max(0, now - ts) * rate)
+  if available < cost then
+    denied = true
+    if rate <= 0 then
+      retry = -1
+    elseif retry >= 0 then
+      retry = math.max(retry, (cost - available) / rate)
+    end
+  end
+  tokens[i] = available
+end
+if denied then return {0, tostring(retry)} end
+for i, key in ipairs(KEYS) do
+  local rate, burst = tonumber(ARGV[2 * i + 1]), tonumber(ARGV[2 * i + 2])
+  redis.call('HSET', key, 'tokens', tokens[i] - cost, 'ts', now)
+  if rate > 0 then redis.call('EXPIRE', key, math.ceil(burst / rate) + 1) end
+end
+return {1, '0'}
+"""
+
+    def __init__(self, url, prefix='lms:rl:'):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self._script = self.client.register_script(self.SCRIPT)
+
+    def consume(self, key, rate, burst, cost=1, now=None):
+        return self.consume_all([(key, rate, burst)], cost, now)
+
+    def consume_all(self, buckets, cost=1, now=None):
+        now = time.time() if now is None else now
+        args = [cost, now]
+        for _, rate, burst in buckets:
+            args.extend((rate, burst))
+        allowed, retry = self._script(keys=[self.prefix + key for key, _, _ in buckets], args=args)
+        retry = float(retry)
+        return bool(allowed), (float('inf') if retry < 0 else retry)
+
+    def reset(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+
+class LoadMonitor(object):
+    """Tracks how long requests wait before being served.
+
+    When the front proxy sends X-Request-Start (nginx `t=${msec}` or a plain
+    epoch in s/ms/us) the real queue time is used. Otherwise the estimate
+    falls back to a moving average of recent response times, which rises
+    along with the backlog once the worker pool is saturated.
+
+    The estimate halves every `half_life` seconds without new samples, so
+    it recovers even while shed requests (which are never sampled) are
+    the only traffic.
+    """
+
+    def __init__(self, alpha=0.2, half_life=5.0):
+        self.alpha = alpha
+        self.half_life = half_life
+        self.in_flight = 0
+        self._latency = 0.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def queue_time(header, now):
+        if not header:
+            return None
+        value = header.strip()
+        if value.startswith('t='):
+            value = value[2:]
+        try:
+            start = float(value)
+        except ValueError:
+            return None
+        # Normalise microseconds / milliseconds to seconds
+        while start > now * 100:
+            start /= 1000.0
+        return max(0.0, now - start)
+
+    def _decayed(self, now):
+        if not self.half_life:
+            return self._latency
+        return self._latency * 0.5 ** (max(0.0, now - self._updated) / self.half_life)
+
+    @property
+    def latency(self):
+        with self._lock:
+            return self._decayed(time.monotonic())
+
+    def _observe(self, sample):
+        now = time.monotonic()
+        current = self._decayed(now)
+        self._latency = current + self.alpha * (sample - current)
+        self._updated = now
+
+    def started(self, queue_time=None):
+        with self._lock:
+            self.in_flight += 1
+            if queue_time is not None:
+                self._observe(queue_time)
+
+    def finished(self, elapsed=None):
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+            if elapsed is not None:
+                self._observe(elapsed)
+
+
+class RateLimiter(object):
+    """Flask extension wiring token buckets and load shedding into requests.
+
+    Config keys (all optional):
+        RATELIMIT_ENABLED       turn the middleware on/off (default True)
+        RATELIMIT_ROUTES        {rule: {'rate', 'burst', 'ip_rate', 'ip_burst', 'priority', 'per', 'stream'}}
+        RATELIMIT_BACKEND       bucket store, e.g. RedisBackend(url) (default MemoryBackend())
+        RATELIMIT_REDIS_URL     use a RedisBackend on this URL when no backend is given
+        RATELIMIT_DEFAULT       limit applied to routes not listed (default none)
+        RATELIMIT_SHED_LATENCY  queue latency in seconds that starts shedding
+        RATELIMIT_SHED_FACTORS  per-priority multipliers of the threshold
+        RATELIMIT_SHED_EXEMPT   endpoints that are never shed
+        RATELIMIT_SHED_DECAY    half-life in seconds of the latency estimate (5)
+        RATELIMIT_TRUST_PROXY   take the client IP from X-Forwarded-For
+    """
+
+    def __init__(self, app=None, backend=None):
+        self.backend = backend
+        self.monitor = LoadMonitor()
+        self.shed_count = dict.fromkeys(PRIORITIES, 0)
+        self.limited_count = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RATELIMIT_ENABLED', True)
+        app.config.setdefault('RATELIMIT_ROUTES', dict(DEFAULT_ROUTE_LIMITS))
+        app.config.setdefault('RATELIMIT_DEFAULT', None)
+        app.config.setdefault('RATELIMIT_SHED_LATENCY', 1.0)
+        app.config.setdefault('RATELIMIT_SHED_FACTORS', dict(DEFAULT_SHED_FACTORS))
+        app.config.setdefault('RATELIMIT_SHED_EXEMPT', DEFAULT_SHED_EXEMPT)
+        app.config.setdefault('RATELIMIT_SHED_DECAY', 5.0)
+        self.monitor.half_life = app.config['RATELIMIT_SHED_DECAY']
+        app.config.setdefault('RATELIMIT_TRUST_PROXY', False)
+        app.config.setdefault('RATELIMIT_REDIS_URL', None)
+        if self.backend is None:
+            self.backend = app.config.get('RATELIMIT_BACKEND')
+        if self.backend is None:
+            url = app.config['RATELIMIT_REDIS_URL']
+            self.backend = RedisBackend(url) if url else MemoryBackend()
+        app.extensions['ratelimit'] = self
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+
+    def _limit_for(self, app, rule):
+        limits = app.config['RATELIMIT_ROUTES']
+        if rule in limits:
+            return limits[rule]
+        return app.config['RATELIMIT_DEFAULT']
+
+    def _client_ip(self, app):
+        if app.config['RATELIMIT_TRUST_PROXY'] and request.access_route:
+            return request.access_route[0]
+        return request.remote_addr or 'unknown'
+
+    def _reject(self, message, retry_after):
+        retry_after = max(1, int(math.ceil(min(retry_after, 3600))))
+        response = jsonify({'error': message, 'retry_after': retry_after})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(retry_after)
+        return response
+
+    def _before_request(self):
+        app = current_app
+        if not app.config['RATELIMIT_ENABLED']:
+            return None
+        now = time.time()
+        rule = request.url_rule.rule if request.url_rule is not None else None
+        limit = self._limit_for(app, rule) if rule else None
+
+        queue_time = self.monitor.queue_time(request.headers.get('X-Request-Start'), now)
+        self.monitor.started(queue_time)
+        # Response times only feed the estimate when no queue header is sent,
+        # and never from long-lived streams
+        request.environ['lms.ratelimit'] = (now, queue_time is None and not (limit or {}).get('stream'))
+
+        rejected = self.shed(app, rule)
+        if rejected is not None:
+            # A fast rejection says nothing about how loaded we are
+            request.environ['lms.ratelimit'] = (now, False)
+            return rejected
+
+        return self.check(app, rule)
+
+    def admit(self, app, rule):
+        """Shedding and token-bucket checks for a request dispatched outside
+        before_request (batch sub-requests, ASGI routes); a 429 response or None."""
+        if not app.config['RATELIMIT_ENABLED']:
+            return None
+        return self.shed(app, rule) or self.check(app, rule)
+
+    def shed(self, app, rule):
+        """Shed the current request if the latency estimate is over its class's threshold."""
+        threshold = app.config['RATELIMIT_SHED_LATENCY']
+        if not threshold or request.endpoint in app.config['RATELIMIT_SHED_EXEMPT']:
+            return None
+        limit = self._limit_for(app, rule) if rule else None
+        priority = (limit or {}).get('priority', 'normal')
+        factor = app.config['RATELIMIT_SHED_FACTORS'].get(priority, 1.0)
+        latency = self.monitor.latency
+        if latency <= threshold * factor:
+            return None
+        self.shed_count[priority] = self.shed_count.get(priority, 0) + 1
+        return self._reject('Server busy, please retry shortly', latency)
+
+    def check(self, app, rule):
+        """Token-bucket check of `rule` for the current request; a 429 response or None."""
+        limit = self._limit_for(app, rule) if rule else None
+        if not limit:
+            return None
+        rate = float(limit.get('rate', 1.0))
+        burst = int(limit.get('burst', 1))
+        buckets = []
+        per = limit.get('per', ('user', 'ip'))
+        if 'user' in per and session.get('user_id') is not None:
+            buckets.append(('%s|user:%s' % (rule, session['user_id']), rate, burst))
+        # Anonymous requests to per-user routes fall back to the IP bucket
+        if 'ip' in per or not buckets:
+            buckets.append(('%s|ip:%s' % (rule, self._client_ip(app)),
+                            float(limit.get('ip_rate', rate)), int(limit.get('ip_burst', burst))))
+        allowed, retry_after = self.backend.consume_all(buckets)
+        if not allowed:
+            self.limited_count += 1
+            return self._reject('Too many requests', retry_after)
+        return None
+
+    def detach(self):
+        """Keep teardown from finishing the current request's load sample and
+        return a function that finishes it. For responses sent after the
+        request context is gone (asgi.py)."""
+        started = request.environ.pop('lms.ratelimit', None)
+        return lambda: self._finished(started)
+
+    def _teardown_request(self, exc=None):
+        self._finished(request.environ.pop('lms.ratelimit', None))
+
+    def _finished(self, started):
+        if started is None:
+            return
+        start, sample = started
+        self.monitor.finished(time.time() - start if sample else None)
@@ -0,0 +1,211 @@
+"""Notification retention: batched purge, archiving and monthly partitions.
+
+Expired notifications (read ones after NOTIFICATION_READ_TTL_DAYS, unread
+ones after NOTIFICATION_UNREAD_TTL_DAYS) are copied to the archive table
+and deleted in small batches, each in its own short transaction, so the
+live table is never locked for long. On PostgreSQL the notification table
+can also be converted to declarative monthly range partitions, after
+which whole expired months are archived and dropped at once.
+
+The functions here work on whatever model/table they are given; the
+`flask notifications` commands in app.py wire them to the real models.
+"""
+import logging
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import and_, delete, insert, or_, select, text
+
+logger = logging.getLogger('lms.retention')
+
+
+def expiry_filter(model, read_before, unread_before):
+    return or_(
+        and_(model.read.is_(True), model.created_at < read_before),
+        and_(or_(model.read.is_(False), model.read.is_(None)), model.created_at < unread_before),
+    )
+
+
+def purge_expired(session, model, archive_model=None, read_ttl_days=30, unread_ttl_days=180,
+                  batch_size=500, pause=0.05, max_batches=None, dry_run=False, now=None):
+    """Archive (optionally) and delete expired rows in batches.
+
+    Returns {'archived': n, 'deleted': n, 'batches': n}. With dry_run only
+    counts what would be removed.
+    """
+    now = now or datetime.utcnow()
+    condition = expiry_filter(model, now - timedelta(days=read_ttl_days),
+                              now - timedelta(days=unread_ttl_days))
+    table = model.__table__
+    if dry_run:
+        count = session.query(model.id).filter(condition).count()
+        return {'archived': 0, 'deleted': 0, 'batches': 0, 'expired': count}
+
+    columns = [c.name for c in table.columns]
+    stats = {'archived': 0, 'deleted': 0, 'batches': 0}
+    while max_batches is None or stats['batches'] < max_batches:
+        # Every worker process may run a purger; locking the batch (and skipping
+        # rows another purger holds) keeps two of them from archiving it twice.
+        # SQLite ignores this, but serialises the writes that follow.
+        ids = [row[0] for row in session.execute(
+            select(table.c.id).where(condition).order_by(table.c.id).limit(batch_size)
+            .with_for_update(skip_locked=True))]
+        if not ids:
+            break
+        if archive_model is not None:
+            archive = archive_model.__table__
+            source = select(*[table.c[name] for name in columns]).where(table.c.id.in_(ids))
+            # The archive has its own key; the notification id goes to original_id
+            targets = ['original_id' if name == 'id' else name for name in columns]
+            session.execute(insert(archive).from_select(targets, source))
+            stats['archived'] += len(ids)
+        result = session.execute(delete(table).where(table.c.id.in_(ids)))
+        session.commit()
+        stats['deleted'] += result.rowcount if result.rowcount is not None and result.rowcount >= 0 else len(ids)
+        stats['batches'] += 1
+        if len(ids) < batch_size:
+            break
+        if pause:
+            # Let queued writers in between batches
+            time.sleep(pause)
+    return stats
+
+
+def purge_archive(session, archive_model, ttl_days, batch_size=1000, now=None):
+    """Delete archived rows older than ttl_days (by original created_at)."""
+    now = now or datetime.utcnow()
+    table = archive_model.__table__
+    total = 0
+    while True:
+        ids = [row[0] for row in session.execute(
+            select(table.c.id).where(table.c.created_at < now - timedelta(days=ttl_days)).limit(batch_size))]
+        if not ids:
+            return total
+        session.execute(delete(table).where(table.c.id.in_(ids)))
+        session.commit()
+        total += len(ids)
+
+
+class PurgeWorker(threading.Thread):
+    """Daemon thread running `job()` every `interval` seconds inside an app context."""
+
+    def __init__(self, app, job, interval):
+        super().__init__(name='notification-purge', daemon=True)
+        self.app = app
+        self.job = job
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                with self.app.app_context():
+                    stats = self.job()
+                if stats.get('deleted'):
+                    logger.info('notification purge: %s', stats)
+            except Exception:
+                logger.exception('notification purge failed')
+
+    def stop(self):
+        self.stopped.set()
+
+
+# PostgreSQL monthly partitioning
+
+def _month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def _add_months(value, months):
+    month = value.month - 1 + months
+    return date(value.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_name(table_name, month):
+    return '%s_p%04d_%02d' % (table_name, month.year, month.month)
+
+
+def is_partitioned(conn, table_name):
+    row = conn.execute(text("SELECT c.relkind FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+                            "WHERE c.relname = :name AND n.nspname = current_schema()"),
+                       {'name': table_name}).first()
+    return row is not None and row[0] == 'p'
+
+
+def list_partitions(conn, table_name):
+    rows = conn.execute(text("SELECT c.relname FROM pg_inherits i "
+                             "JOIN pg_class c ON c.oid = i.inhrelid "
+                             "JOIN pg_class p ON p.oid = i.inhparent "
+                             "WHERE p.relname = :name ORDER BY c.relname"), {'name': table_name})
+    return [row[0] for row in rows]
+
+
+def ensure_partitions(conn, table_name, start, months_ahead=3, today=None):
+    """Create monthly partitions from `start` until `months_ahead` past today."""
+    today = today or datetime.utcnow().date()
+    month = _month_start(start)
+    last = _add_months(_month_start(today), months_ahead)
+    created = []
+    while month <= last:
+        name = partition_name(table_name, month)
+        conn.execute(text('CREATE TABLE IF NOT EXISTS "%s" PARTITION OF "%s" FOR VALUES FROM (\'%s\') TO (\'%s\')'
+                          % (name, table_name, month.isoformat(), _add_months(month, 1).isoformat())))
+        created.append(name)
+        month = _add_months(month, 1)
+    conn.execute(text('CREATE TABLE IF NOT EXISTS "%s_default" PARTITION OF "%s" DEFAULT'
+                      % (table_name, table_name)))
+    return created
+
+
+def convert_to_partitioned(conn, table_name, months_ahead=3):
+    """Rebuild `table_name` as a table range-partitioned by month on created_at.
+
+    The old table is kept as <table>_unpartitioned so it can be checked and
+    dropped by hand. Run inside a transaction (e.g. engine.begin()).
+    """
+    if is_partitioned(conn, table_name):
+        return None
+    old = table_name + '_unpartitioned'
+    conn.execute(text('LOCK TABLE "%s" IN ACCESS EXCLUSIVE MODE' % table_name))
+    conn.execute(text('ALTER TABLE "%s" RENAME TO "%s"' % (table_name, old)))
+    conn.execute(text('UPDATE "%s" SET created_at = now() WHERE created_at IS NULL' % old))
+    conn.execute(text('CREATE TABLE "%s" (LIKE "%s" INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)'
+                      % (table_name, old)))
+    conn.execute(text('ALTER TABLE "%s" ALTER COLUMN created_at SET NOT NULL' % table_name))
+    conn.execute(text('ALTER TABLE "%s" ADD PRIMARY KEY (id, created_at)' % table_name))
+    conn.execute(text('ALTER TABLE "%s" ADD FOREIGN KEY (user_id) REFERENCES "user" (id)' % table_name))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS "ix_%s_user_created_p" ON "%s" (user_id, created_at)'
+                      % (table_name, table_name)))
+    conn.execute(text("ALTER SEQUENCE IF EXISTS \"%s_id_seq\" OWNED BY \"%s\".id" % (table_name, table_name)))
+    oldest = conn.execute(text('SELECT min(created_at) FROM "%s"' % old)).scalar()
+    ensure_partitions(conn, table_name, (oldest or datetime.utcnow()).date(), months_ahead)
+    moved = conn.execute(text('INSERT INTO "%s" SELECT * FROM "%s"' % (table_name, old))).rowcount
+    return moved
+
+
+def drop_expired_partitions(conn, table_name, before, archive_table=None):
+    """Archive and drop monthly partitions that end on or before `before`.
+
+    Only partitions whose whole month has expired are touched; rows in the
+    current months are left to purge_expired.
+    """
+    dropped = []
+    prefix = table_name + '_p'
+    for name in list_partitions(conn, table_name):
+        if not name.startswith(prefix):
+            continue
+        try:
+            year, month = int(name[len(prefix):len(prefix) + 4]), int(name[-2:])
+        except ValueError:
+            continue
+        if _add_months(date(year, month, 1), 1) > before:
+            continue
+        conn.execute(text('ALTER TABLE "%s" DETACH PARTITION "%s"' % (table_name, name)))
+        if archive_table is not None:
+            conn.execute(text('INSERT INTO "%s" (original_id, user_id, title, message, created_at, read) '
+                              'SELECT id, user_id, title, message, created_at, read FROM "%s"'
+                              % (archive_table, name)))
+        conn.execute(text('DROP TABLE "%s"' % name))
+        dropped.append(name)
+    return dropped
@@ -0,0 +1,159 @@
+"""Cached course rosters: course_id -> frozenset of enrolled student ids.
+
+Write paths that notify a course, mark attendance or check enrollment
+used to load every Enrollment row as an ORM object. The cache loads a
+roster once with a column-only query and keeps it as a frozenset, so
+membership checks are O(1).
+
+Entries are invalidated when Enrollment rows are flushed or committed in
+this process and expire after ROSTER_CACHE_TTL seconds to bound staleness
+across worker processes. A negative membership check on an entry older
+than ROSTER_CACHE_MISS_REFRESH seconds reloads the roster once before
+answering, so a student enrolled through another worker is not refused.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+class RosterCache(object):
+    """Config keys (all optional):
+        ROSTER_CACHE_TTL            seconds before an entry is reloaded (30)
+        ROSTER_CACHE_SIZE           courses kept, least recently used evicted (2048)
+        ROSTER_CACHE_MISS_REFRESH   min entry age for a miss to force a reload (1)
+    """
+
+    def __init__(self, app=None, loader=None, model=None):
+        self.loader = loader
+        self.model = model
+        self.ttl = 30
+        self.size = 2048
+        self.miss_refresh = 1.0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        # Bumped by invalidate(); a load only stores its result if they did not
+        # move while its query ran, so it cannot overwrite a newer invalidation.
+        self._generations = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ROSTER_CACHE_TTL', 30)
+        app.config.setdefault('ROSTER_CACHE_SIZE', 2048)
+        app.config.setdefault('ROSTER_CACHE_MISS_REFRESH', 1.0)
+        self.ttl = app.config['ROSTER_CACHE_TTL']
+        self.size = app.config['ROSTER_CACHE_SIZE']
+        self.miss_refresh = app.config['ROSTER_CACHE_MISS_REFRESH']
+        app.extensions['roster'] = self
+        _install_session_events()
+
+        instrumentation = app.extensions.get('instrumentation')
+        if instrumentation is not None:
+            instrumentation.registry.gauge(
+                'lms_roster_cache_requests_total', 'Roster cache lookups by result.', ('result',),
+                lambda: {('hit',): self.hits, ('miss',): self.misses}, 'counter')
+
+    def _generation(self, course_id):
+        return self._epoch, self._generations.get(course_id, 0)
+
+    def _load(self, course_id):
+        with self._lock:
+            generation = self._generation(course_id)
+        members = frozenset(self.loader(course_id))
+        with self._lock:
+            if self._generation(course_id) == generation:
+                self._entries[course_id] = (members, time.monotonic())
+                self._entries.move_to_end(course_id)
+                while len(self._entries) > self.size:
+                    self._entries.popitem(last=False)
+        return members
+
+    def _lookup(self, course_id):
+        with self._lock:
+            entry = self._entries.get(course_id)
+            if entry is not None and (not self.ttl or time.monotonic() - entry[1] < self.ttl):
+                self._entries.move_to_end(course_id)
+                self.hits += 1
+                return entry
+            self.misses += 1
+        return None
+
+    def get(self, course_id):
+        """Frozenset of student ids enrolled in course_id."""
+        entry = self._lookup(course_id)
+        if entry is not None:
+            return entry[0]
+        return self._load(course_id)
+
+    def contains(self, course_id, student_id):
+        entry = self._lookup(course_id)
+        if entry is None:
+            return student_id in self._load(course_id)
+        members, loaded = entry
+        if student_id in members:
+            return True
+        if time.monotonic() - loaded >= self.miss_refresh:
+            return student_id in self._load(course_id)
+        return False
+
+    def invalidate(self, course_id=None):
+        with self._lock:
+            if course_id is None:
+                self._entries.clear()
+                self._epoch += 1
+            else:
+                self._entries.pop(course_id, None)
+                self._generations[course_id] = self._generations.get(course_id, 0) + 1
+
+
+def _touched_courses(session):
+    return session.info.setdefault('roster_courses', set())
+
+
+def _after_flush(session, flush_context):
+    if not has_app_context():
+        return
+    cache = current_app.extensions.get('roster')
+    if cache is None or cache.model is None:
+        return
+    touched = _touched_courses(session)
+    for obj in list(session.new) + list(session.deleted) + list(session.dirty):
+        if isinstance(obj, cache.model) and obj.course_id is not None:
+            touched.add(obj.course_id)
+    # Drop now so this session sees its own writes; again on commit for everyone else.
+    for course_id in touched:
+        cache.invalidate(course_id)
+
+
+def _after_commit(session):
+    touched = session.info.pop('roster_courses', None)
+    if not touched or not has_app_context():
+        return
+    cache = current_app.extensions.get('roster')
+    if cache is not None:
+        for course_id in touched:
+            cache.invalidate(course_id)
+
+
+def _after_rollback(session):
+    session.info.pop('roster_courses', None)
+
+
+_events_installed = False
+
+
+def _install_session_events():
+    global _events_installed
+    if _events_installed:
+        return
+    event.listen(Session, 'after_flush', _after_flush)
+    event.listen(Session, 'after_commit', _after_commit)
+    event.listen(Session, 'after_soft_rollback', lambda session, previous: _after_rollback(session))
+    _events_installed = True
@@ -0,0 +1,57 @@
+import pytest
+from werkzeug.security import generate_password_hash
+
+from app import create_app, db, Course, User
+
+
+def make_app(db_path, **config):
+    settings = {
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///%s' % db_path,
+        'RATELIMIT_ENABLED': False,
+    }
+    settings.update(config)
+    return create_app(settings)
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    """A database file with one teacher, one course and two students."""
+    path = tmp_path / 'lms.db'
+    app = make_app(path)
+    with app.app_context():
+        db.create_all()
+        teacher = User(name='Teacher', email='teacher@example.com',
+                       password=generate_password_hash('password'), role='teacher')
+        db.session.add(teacher)
+        db.session.flush()
+        db.session.add(Course(title='Course', description='Description', duration='4 weeks',
+                              teacher_id=teacher.id))
+        for n in range(2):
+            db.session.add(User(name='Student %d' % n, email='student%d@example.com' % n,
+                                password=generate_password_hash('password'), role='student'))
+        db.session.commit()
+        db.session.remove()
+    return path
+
+
+@pytest.fixture
+def app(db_path):
+    app = make_app(db_path)
+    with app.app_context():
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def ids(app):
+    return {
+        'teacher': User.query.filter_by(role='teacher').one().id,
+        'course': Course.query.one().id,
+        'students': [u.id for u in User.query.filter_by(role='student').order_by(User.id)],
+    }
@@ -0,0 +1,143 @@
+import asyncio
+import gzip
+import json
+import re
+import time
+
+import pytest
+
+pytest.importorskip('aiofiles')
+pytest.importorskip('aiosqlite')
+
+from app import db, Notification  # noqa: E402
+from conftest import make_app  # noqa: E402
+from jsonprovider import STREAM_BATCH, stream_json_array  # noqa: E402
+
+
+@pytest.fixture
+def build(db_path):
+    import asgi
+    apps = []
+
+    def build(**config):
+        config.setdefault('NOTIFICATION_STREAM_INTERVAL', 0.1)
+        async_app = asgi.AsyncApp(make_app(db_path, **config))
+        apps.append(async_app)
+        return async_app
+    yield build
+    for async_app in apps:
+        async_app.executor.shutdown()
+
+
+def _notify(flask_app, user_id, count):
+    with flask_app.app_context():
+        notifications = [Notification(user_id=user_id, title='n%d' % n, message='m') for n in range(count)]
+        db.session.add_all(notifications)
+        db.session.commit()
+        return [n.id for n in notifications]
+
+
+async def _call(async_app, path, headers=(), during=None):
+    """Run one GET through the ASGI app; returns (status, headers, body, body messages)."""
+    scope = {'type': 'http', 'method': 'GET', 'path': path, 'root_path': '', 'query_string': b'',
+             'headers': [(k.lower().encode(), v.encode()) for k, v in headers],
+             'client': ('127.0.0.1', 50000), 'server': ('testserver', 80), 'http_version': '1.1',
+             'scheme': 'http'}
+    messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+    done = asyncio.Event()
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await done.wait()
+        return {'type': 'http.disconnect'}
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    try:
+        if during is not None:
+            await asyncio.gather(async_app(scope, receive, send), during())
+        else:
+            await async_app(scope, receive, send)
+    finally:
+        done.set()
+        await async_app.db.close()
+    start = sent[0]
+    assert sent[-1].get('more_body') is not True
+    return (start['status'], {k.decode().lower(): v.decode() for k, v in start['headers']},
+            b''.join(m.get('body', b'') for m in sent[1:]), len(sent) - 1)
+
+
+def test_notification_list(build, ids):
+    async_app = build(COMPRESS_STREAMS=True)
+    user = ids['students'][0]
+    created = _notify(async_app.app, user, 3)
+    status, headers, body, _ = asyncio.run(_call(
+        async_app, '/api/notifications/%d' % user,
+        [('Origin', 'http://spa.example'), ('Accept-Encoding', 'gzip')]))
+    assert status == 200
+    assert headers['access-control-allow-origin'] == 'http://spa.example'
+    assert headers['content-encoding'] == 'gzip'
+    items = json.loads(gzip.decompress(body))
+    assert sorted(item['id'] for item in items) == created
+    assert set(items[0]) == {'id', 'title', 'message', 'created_at', 'read'}
+
+
+def test_notification_list_is_shed_with_cors(build, ids):
+    async_app = build(RATELIMIT_ENABLED=True)
+    limiter = async_app.app.extensions['ratelimit']
+    limiter.monitor.started()
+    limiter.monitor.finished(10.0)
+    status, headers, body, _ = asyncio.run(_call(
+        async_app, '/api/notifications/%d' % ids['students'][0], [('Origin', 'http://spa.example')]))
+    assert status == 429
+    assert headers['access-control-allow-origin'] == 'http://spa.example'
+    assert json.loads(body)['error'] == 'Server busy, please retry shortly'
+
+
+def test_notification_stream_resumes_then_follows(build, ids):
+    async_app = build(NOTIFICATION_STREAM_TIMEOUT=1.5)
+    user = ids['students'][0]
+    first = _notify(async_app.app, user, 3)
+    live = []
+
+    async def notify_later():
+        await asyncio.sleep(0.5)
+        live.extend(await asyncio.get_running_loop().run_in_executor(None, _notify, async_app.app, user, 2))
+
+    started = time.monotonic()
+    status, headers, body, _ = asyncio.run(_call(
+        async_app, '/api/notifications/%d/stream' % user,
+        [('Last-Event-ID', str(first[0])), ('Origin', 'http://spa.example')], notify_later))
+    assert status == 200
+    assert headers['content-type'] == 'text/event-stream'
+    assert headers['access-control-allow-origin'] == 'http://spa.example'
+    assert 1.4 < time.monotonic() - started < 5
+    text = body.decode()
+    assert text.startswith('retry: ')
+    # Missed rows first, in order, then the live ones, each once
+    assert [int(n) for n in re.findall(r'^id: (\d+)$', text, re.M)] == first[1:] + live
+
+
+def test_other_routes_run_on_the_thread_pool(build):
+    async_app = build()
+    status, headers, body, _ = asyncio.run(_call(async_app, '/api/courses'))
+    assert status == 200
+    assert json.loads(body)[0]['title'] == 'Course'
+
+
+def test_streamed_responses_are_sent_in_chunks(build):
+    async_app = build(ASYNC_STREAM_BUFFER=2)
+
+    @async_app.app.route('/numbers')
+    def numbers():
+        return stream_json_array(range(STREAM_BATCH * 5))
+
+    status, headers, body, messages = asyncio.run(_call(async_app, '/numbers'))
+    assert status == 200
+    assert json.loads(body) == list(range(STREAM_BATCH * 5))
+    # '[', five batches, ']' and the closing empty message
+    assert messages == 8
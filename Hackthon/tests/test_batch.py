@@ -0,0 +1,44 @@
+import pytest
+
+from conftest import make_app
+
+
+def _statuses(response):
+    assert response.status_code == 200
+    return [item['status'] for item in response.get_json()['responses']]
+
+
+@pytest.mark.parametrize('parallel', [False, True])
+def test_statuses_pass_through(client, ids, parallel):
+    response = client.post('/api/batch', json={'parallel': parallel, 'requests': [
+        '/api/courses',
+        {'id': 'missing', 'path': '/api/nope'},
+        '/api/course/%d' % ids['course'],
+    ]})
+    assert _statuses(response) == [200, 404, 200]
+    items = response.get_json()['responses']
+    assert items[1]['id'] == 'missing'
+    assert items[0]['body'][0]['id'] == ids['course']
+
+
+def test_sub_requests_are_rate_limited(db_path):
+    app = make_app(db_path, RATELIMIT_ENABLED=True,
+                   RATELIMIT_ROUTES={'/api/courses': {'rate': 0.01, 'burst': 1}})
+    response = app.test_client().post('/api/batch', json={'requests': ['/api/courses', '/api/courses']})
+    assert _statuses(response) == [200, 429]
+    assert response.get_json()['responses'][1]['body']['error'] == 'Too many requests'
+
+
+def test_sub_requests_are_shed_by_priority(db_path):
+    app = make_app(db_path, RATELIMIT_ENABLED=True, RATELIMIT_SHED_LATENCY=1.0)
+    limiter = app.extensions['ratelimit']
+    limiter.monitor.started()
+    limiter.monitor.finished(6.0)  # estimate 1.2: above 'low' (1.0), below 'normal' (2.0)
+    response = app.test_client().post('/api/batch', json={'requests': ['/api/courses', '/api/notifications/1']})
+    assert _statuses(response) == [200, 429]
+    assert limiter.shed_count['low'] == 1
+
+
+def test_streams_are_refused(client):
+    response = client.post('/api/batch', json={'requests': ['/api/notifications/1/stream']})
+    assert response.status_code == 400
@@ -0,0 +1,42 @@
+from sqlalchemy import inspect
+
+from app import db, Course, Notification, User
+from conftest import make_app
+
+
+def test_create_app_does_not_touch_the_database(tmp_path):
+    # The directory does not exist, so any connection attempt would fail
+    app = make_app(tmp_path / 'missing' / 'lms.db')
+    assert app.config['STARTUP_SECONDS'] >= 0
+
+
+def test_db_init_and_seed(tmp_path):
+    app = make_app(tmp_path / 'lms.db')
+    runner = app.test_cli_runner()
+
+    result = runner.invoke(args=['db', 'init'])
+    assert result.exit_code == 0, result.output
+    with app.app_context():
+        tables = set(inspect(db.engine).get_table_names())
+    assert {'user', 'course', 'enrollment', 'notification', 'notification_archive'} <= tables
+    # Running it again only adds what is missing
+    assert runner.invoke(args=['db', 'init']).exit_code == 0
+
+    result = runner.invoke(args=['seed'])
+    assert result.exit_code == 0, result.output
+    assert 'Seed data loaded.' in result.output
+    assert runner.invoke(args=['seed']).exit_code == 0
+    with app.app_context():
+        assert User.query.filter_by(email='teacher@example.com').count() == 1
+        assert Course.query.count() == 3
+
+
+def test_seed_synthetic_data(tmp_path):
+    app = make_app(tmp_path / 'lms.db')
+    runner = app.test_cli_runner()
+    assert runner.invoke(args=['db', 'init']).exit_code == 0
+    result = runner.invoke(args=['seed', '--scale', 'small', '--seed', '1'])
+    assert result.exit_code == 0, result.output
+    with app.app_context():
+        assert User.query.count() > 200
+        assert Notification.query.count() > 0
@@ -0,0 +1,99 @@
+import gzip
+import io
+
+import pytest
+from flask import send_file
+
+from compression import available_encoders
+from conftest import make_app
+from jsonprovider import jsonify, stream_json_array
+
+BIG = [{'id': n, 'title': 'Assignment %d' % n} for n in range(200)]
+
+
+@pytest.fixture
+def compress_app(db_path):
+    def build(**config):
+        app = make_app(db_path, **config)
+
+        @app.route('/big')
+        def big():
+            return jsonify(BIG)
+
+        @app.route('/small')
+        def small():
+            return jsonify({'ok': True})
+
+        @app.route('/download')
+        def download():
+            return send_file(io.BytesIO(b'x' * 5000), mimetype='text/plain')
+
+        @app.route('/stream')
+        def stream():
+            return stream_json_array(BIG)
+
+        return app
+    return build
+
+
+def _get(app, path, accept):
+    response = app.test_client().get(path, headers={'Accept-Encoding': accept})
+    data = response.get_data()
+    response.close()
+    return response, data
+
+
+def jsonify_bytes(app, value):
+    with app.app_context():
+        return jsonify(value).get_data()
+
+
+def test_gzip(compress_app):
+    response, data = _get(compress_app(), '/big', 'gzip')
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert int(response.headers['Content-Length']) == len(data)
+    assert gzip.decompress(data) == jsonify_bytes(compress_app(), BIG)
+
+
+def test_negotiation_prefers_best_accepted(compress_app):
+    names = [name for name, _ in available_encoders()]
+    response, _ = _get(compress_app(), '/big', 'gzip, br, zstd')
+    assert response.headers['Content-Encoding'] == names[0]
+    response, _ = _get(compress_app(COMPRESS_ALGORITHMS=['gzip']), '/big', 'br, zstd, gzip')
+    assert response.headers['Content-Encoding'] == 'gzip'
+
+
+@pytest.mark.parametrize('accept', ['identity', 'gzip;q=0', ''])
+def test_not_accepted(compress_app, accept):
+    response, data = _get(compress_app(), '/big', accept)
+    assert 'Content-Encoding' not in response.headers
+    assert data == jsonify_bytes(compress_app(), BIG)
+
+
+def test_small_responses_are_not_compressed(compress_app):
+    response, _ = _get(compress_app(), '/small', 'gzip')
+    assert 'Content-Encoding' not in response.headers
+    app = compress_app(COMPRESS_MIN_SIZE=100000)
+    response, _ = _get(app, '/big', 'gzip')
+    assert 'Content-Encoding' not in response.headers
+    assert app.extensions['compression'].skipped['small'] == 1
+
+
+def test_passthrough_is_skipped(compress_app):
+    app = compress_app()
+    response, data = _get(app, '/download', 'gzip')
+    assert 'Content-Encoding' not in response.headers
+    assert data == b'x' * 5000
+    assert app.extensions['compression'].skipped['passthrough'] == 1
+
+
+def test_streams_only_when_enabled(compress_app):
+    response, data = _get(compress_app(), '/stream', 'gzip')
+    assert 'Content-Encoding' not in response.headers
+    assert data.startswith(b'[')
+
+    response, data = _get(compress_app(COMPRESS_STREAMS=True), '/stream', 'gzip')
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Length' not in response.headers
+    assert gzip.decompress(data) == jsonify_bytes(compress_app(), BIG)
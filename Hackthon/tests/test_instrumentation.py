@@ -0,0 +1,42 @@
+import logging
+
+from app import db, User
+from conftest import make_app
+
+
+def test_metrics_after_a_request(client):
+    response = client.get('/api/courses')
+    assert int(response.headers['X-SQL-Count']) >= 1
+    assert response.headers['Server-Timing'].startswith('app;dur=')
+
+    metrics = client.get('/metrics')
+    assert metrics.status_code == 200
+    assert metrics.mimetype == 'text/plain'
+    text = metrics.get_data(as_text=True)
+    assert '# TYPE lms_request_duration_seconds histogram' in text
+    assert 'lms_request_duration_seconds_count{method="GET",route="/api/courses",status="200"} 1' in text
+
+
+def test_metrics_need_allowed_address_or_token(db_path):
+    client = make_app(db_path, INSTRUMENT_METRICS_TOKEN='s3cret').test_client()
+    remote = {'REMOTE_ADDR': '203.0.113.9'}
+    assert client.get('/metrics', environ_base=remote).status_code == 403
+    assert client.get('/metrics', environ_base=remote, headers={'Authorization': 'Bearer nope'}).status_code == 403
+    assert client.get('/metrics', environ_base=remote, headers={'Authorization': 'Bearer s3cret'}).status_code == 200
+
+
+def test_n_plus_one_warning(db_path, caplog):
+    app = make_app(db_path, INSTRUMENT_N_PLUS_ONE_THRESHOLD=3)
+
+    @app.route('/loop')
+    def loop():
+        for user_id in range(1, 6):
+            db.session.query(User.name).filter(User.id == user_id).first()
+        return 'ok'
+
+    with caplog.at_level(logging.WARNING, logger='lms.instrumentation'):
+        response = app.test_client().get('/loop')
+    assert response.headers['X-SQL-Count'] == '5'
+    warnings = [r.getMessage() for r in caplog.records if 'possible N+1' in r.getMessage()]
+    assert len(warnings) == 1
+    assert 'GET /loop' in warnings[0]
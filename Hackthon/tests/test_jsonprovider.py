@@ -0,0 +1,79 @@
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+
+from conftest import make_app
+from jsonprovider import STREAM_BATCH, JSONProvider, jsonify, stream_json_array
+
+PAYLOAD = {
+    'created_at': datetime(2024, 3, 1, 9, 30, 15, 123456),
+    'due': datetime(2024, 3, 8, 23, 59),
+    'day': date(2024, 3, 1),
+    'grade': Decimal('9.5'),
+    'score': 0.1,
+    'title': 'Café – week 1 ✓',
+    'tags': ['a', None, True],
+    1: 'int key',
+}
+
+
+def _provider(use_orjson):
+    provider = JSONProvider()
+    provider.use_orjson = use_orjson
+    return provider
+
+
+def test_orjson_and_stdlib_output_match():
+    pytest.importorskip('orjson')
+    assert _provider(True).dumps_bytes(PAYLOAD) == _provider(False).dumps_bytes(PAYLOAD)
+
+
+@pytest.mark.parametrize('use_orjson', [False, True])
+def test_encoding(use_orjson):
+    if use_orjson:
+        pytest.importorskip('orjson')
+    text = _provider(use_orjson).dumps(PAYLOAD)
+    assert ', ' not in text and '": ' not in text
+    decoded = json.loads(text)
+    assert decoded['created_at'] == '2024-03-01T09:30:15.123456'
+    assert decoded['due'] == '2024-03-08T23:59:00'
+    assert decoded['day'] == '2024-03-01'
+    assert decoded['grade'] == 9.5
+    assert decoded['1'] == 'int key'
+
+
+def test_jsonify(db_path):
+    app = make_app(db_path)
+
+    @app.route('/now')
+    def now():
+        return jsonify({'at': datetime(2024, 3, 1, 9, 30)})
+
+    response = app.test_client().get('/now')
+    assert response.mimetype == 'application/json'
+    assert response.data == b'{"at":"2024-03-01T09:30:00"}\n'
+
+
+@pytest.mark.parametrize('count', [0, 1, STREAM_BATCH, STREAM_BATCH * 2 + 3])
+def test_stream_json_array(db_path, count):
+    app = make_app(db_path)
+    consumed = []
+
+    def items():
+        for n in range(count):
+            consumed.append(n)
+            yield {'n': n, 'at': date(2024, 1, 1)}
+
+    @app.route('/items')
+    def item_list():
+        return stream_json_array(items())
+
+    response = app.test_client().get('/items', buffered=False)
+    assert response.is_streamed
+    assert consumed == []  # nothing is built before the body is read
+    data = response.get_data()
+    response.close()
+    assert data.endswith(b']\n')
+    assert json.loads(data) == [{'n': n, 'at': '2024-01-01'} for n in range(count)]
@@ -0,0 +1,108 @@
+import multiprocessing
+import time
+
+import pytest
+
+from conftest import make_app
+from ratelimit import MemoryBackend, SharedBackend
+
+
+@pytest.fixture
+def manager():
+    with multiprocessing.Manager() as manager:
+        yield manager
+
+
+def _drain(backend, key, results):
+    for _ in range(3):
+        results.append(backend.consume(key, 1.0, 3, now=1000.0)[0])
+
+
+def test_shared_backend_refills(manager):
+    backend = SharedBackend.local(manager)
+    assert backend.consume('k', 2.0, 2, now=100.0) == (True, 0.0)
+    assert backend.consume('k', 2.0, 2, now=100.0) == (True, 0.0)
+    allowed, retry_after = backend.consume('k', 2.0, 2, now=100.0)
+    assert not allowed
+    assert retry_after == pytest.approx(0.5)
+    assert backend.consume('k', 2.0, 2, now=100.5)[0]
+    backend.reset()
+    assert backend.consume('k', 2.0, 2, now=100.5) == (True, 0.0)
+
+
+def test_shared_backend_across_processes(manager):
+    backend = SharedBackend.local(manager)
+    results = manager.list()
+    worker = multiprocessing.Process(target=_drain, args=(backend, 'k', results))
+    worker.start()
+    worker.join(10)
+    assert list(results) == [True, True, True]
+    # The other process used up the whole burst
+    assert not backend.consume('k', 1.0, 3, now=1000.0)[0]
+
+
+def test_limit_shared_between_apps(db_path, manager):
+    config = {
+        'RATELIMIT_ENABLED': True,
+        'RATELIMIT_BACKEND': SharedBackend.local(manager),
+        'RATELIMIT_ROUTES': {'/api/courses': {'rate': 0.01, 'burst': 2, 'per': ('ip',)}},
+    }
+    first, second = make_app(db_path, **config).test_client(), make_app(db_path, **config).test_client()
+    assert first.get('/api/courses').status_code == 200
+    assert second.get('/api/courses').status_code == 200
+    response = first.get('/api/courses')
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) > 1
+
+
+def test_shedding_recovers(db_path):
+    app = make_app(db_path, RATELIMIT_ENABLED=True, RATELIMIT_ROUTES={},
+                   RATELIMIT_SHED_LATENCY=0.5, RATELIMIT_SHED_DECAY=0.1)
+    client = app.test_client()
+    limiter = app.extensions['ratelimit']
+    limiter.monitor.started()
+    limiter.monitor.finished(10.0)
+
+    response = client.get('/api/courses')
+    assert response.status_code == 429
+    assert limiter.shed_count['normal'] == 1
+    assert client.get('/metrics').status_code == 200
+    assert client.get('/index.html').status_code == 200
+
+    # Shed requests are not sampled, so only the decay brings the estimate down
+    time.sleep(1.0)
+    assert client.get('/api/courses').status_code == 200
+
+
+@pytest.mark.parametrize('shared', [False, True])
+def test_refused_request_spends_no_tokens(manager, shared):
+    backend = SharedBackend.local(manager) if shared else MemoryBackend()
+    buckets = [('user', 1.0, 5), ('ip', 1.0, 1)]
+    assert backend.consume_all(buckets, now=100.0) == (True, 0.0)
+    allowed, retry_after = backend.consume_all(buckets, now=100.0)
+    assert not allowed
+    assert retry_after == pytest.approx(1.0)
+    # The IP bucket refused, so the user bucket still holds its 4 tokens
+    assert [backend.consume('user', 1.0, 5, now=100.0)[0] for _ in range(5)] == [True] * 4 + [False]
+
+
+def _login(client, email):
+    response = client.post('/api/login', json={'email': email, 'password': 'password'})
+    assert response.status_code == 200
+
+
+def test_submissions_limited_per_user_behind_one_ip(db_path):
+    app = make_app(db_path, RATELIMIT_ENABLED=True)
+    first, second = app.test_client(), app.test_client()
+    _login(first, 'student0@example.com')
+    _login(second, 'student1@example.com')
+    # Both share 127.0.0.1; the burst of 5 is per student
+    assert [first.post('/api/submit', json={}).status_code for _ in range(6)] == [400] * 5 + [429]
+    assert second.post('/api/submit', json={}).status_code == 400
+
+
+def test_anonymous_requests_fall_back_to_ip(db_path):
+    app = make_app(db_path, RATELIMIT_ENABLED=True, RATELIMIT_ROUTES={
+        '/api/submit': {'rate': 0.01, 'burst': 1, 'ip_rate': 0.01, 'ip_burst': 3, 'per': ('user',)}})
+    client = app.test_client()
+    assert [client.post('/api/submit', json={}).status_code for _ in range(4)] == [400] * 3 + [429]
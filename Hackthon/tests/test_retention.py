@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from app import db, Notification, NotificationArchive, purge_notifications
+
+
+def _add(user_id, days_old, read):
+    notification = Notification(user_id=user_id, title='t', message='m', read=read,
+                                created_at=datetime.utcnow() - timedelta(days=days_old))
+    db.session.add(notification)
+    db.session.commit()
+    return notification.id
+
+
+def test_purge_archives_expired(app, ids):
+    user = ids['students'][0]
+    read_expired = _add(user, 40, True)
+    unread_kept = _add(user, 40, False)
+    unread_expired = _add(user, 200, False)
+    fresh = _add(user, 0, True)
+
+    assert purge_notifications(dry_run=True)['expired'] == 2
+    stats = purge_notifications()
+    assert (stats['archived'], stats['deleted']) == (2, 2)
+    assert {n.id for n in Notification.query} == {unread_kept, fresh}
+    assert {a.original_id for a in NotificationArchive.query} == {read_expired, unread_expired}
+
+
+def test_purged_ids_are_not_reused(app, ids):
+    user = ids['students'][0]
+    first = _add(user, 40, True)
+    purge_notifications()
+    second = _add(user, 40, True)
+    assert second > first
+    purge_notifications()
+    archived = NotificationArchive.query.order_by(NotificationArchive.id).all()
+    assert [a.original_id for a in archived] == [first, second]
+
+
+def test_archive_rejects_a_second_copy(app, ids):
+    db.session.add(NotificationArchive(original_id=1, user_id=ids['students'][0], title='t', message='m'))
+    db.session.commit()
+    db.session.add(NotificationArchive(original_id=1, user_id=ids['students'][0], title='t', message='m'))
+    with pytest.raises(IntegrityError):
+        db.session.commit()
+    db.session.rollback()
@@ -0,0 +1,55 @@
+from app import course_roster, is_enrolled
+from conftest import make_app
+from roster import RosterCache
+
+
+def test_enroll_invalidates_roster(app, client, ids):
+    student, course = ids['students'][0], ids['course']
+    assert course_roster(course) == frozenset()
+    response = client.post('/api/enroll', json={'student_id': student, 'course_id': course})
+    assert response.status_code == 201
+    assert course_roster(course) == {student}
+    assert is_enrolled(student, course)
+
+
+def test_miss_reloads_roster_from_another_worker(db_path, ids):
+    stale = make_app(db_path, ROSTER_CACHE_MISS_REFRESH=0)
+    other = make_app(db_path)
+    student, course = ids['students'][1], ids['course']
+    record = {'teacher_id': ids['teacher'], 'course_id': course, 'date': '2024-01-08',
+              'records': [{'student_id': student, 'present': True}]}
+
+    client = stale.test_client()
+    assert client.post('/api/attendance/mark', json=record).get_json()['updated'] == 0
+    response = other.test_client().post('/api/enroll', json={'student_id': student, 'course_id': course})
+    assert response.status_code == 201
+    # The first worker still caches the old roster, but the miss forces a reload
+    assert client.post('/api/attendance/mark', json=record).get_json()['updated'] == 1
+
+
+def test_load_racing_an_invalidation_is_not_cached():
+    rosters = {1: [10]}
+    cache = RosterCache(loader=lambda course_id: list(rosters[course_id]))
+
+    def racing_loader(course_id):
+        members = list(rosters[course_id])
+        # Another thread enrolls a student and invalidates after this query ran
+        rosters[course_id].append(11)
+        cache.invalidate(course_id)
+        return members
+
+    cache.loader = racing_loader
+    assert cache.get(1) == {10}
+    cache.loader = lambda course_id: list(rosters[course_id])
+    assert cache.get(1) == {10, 11}
+
+
+def test_enroll_checks_database_for_duplicates(db_path, ids):
+    cached = make_app(db_path, ROSTER_CACHE_MISS_REFRESH=60)
+    other = make_app(db_path)
+    enrollment = {'student_id': ids['students'][0], 'course_id': ids['course']}
+    with cached.app_context():
+        assert course_roster(ids['course']) == frozenset()
+    assert other.test_client().post('/api/enroll', json=enrollment).status_code == 201
+    # The first worker's roster still says "not enrolled"
+    assert cached.test_client().post('/api/enroll', json=enrollment).status_code == 400
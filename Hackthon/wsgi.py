@@ -0,0 +1,10 @@
+"""WSGI entry point for production servers.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+The app is created once here; with `preload_app` the master process imports
+it before forking, so workers start from an already-initialised copy.
+"""
+from app import create_app
+
+app = create_app()